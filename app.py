@@ -1,14 +1,56 @@
-from flask import Flask, render_template, request, send_file, redirect, url_for, flash, make_response
-from audio_processor import AudioProcessor
+from flask import Flask, render_template, request, send_file, redirect, url_for, flash, make_response, Response, stream_with_context, jsonify
+from audio_processor import AudioProcessor, merge_timing, timing_path
+from jobs import JobManager, QueueFullError
+from result_cache import ResultCache, RenderAbandoned
+from cue_matcher import SFX_CUES
+import dsp
+from instrumentation import METRICS
 from dotenv import load_dotenv
+import base64
+from contextlib import closing
+import json
+import logging
 import os
 from pathlib import Path
+import queue
+import shutil
+import subprocess
 import tempfile
+import threading
+import time
 import re
+import numpy as np
 
 load_dotenv()
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(32))
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", r"ffmpeg-master-latest-win64-gpl-shared\bin\ffmpeg.exe")
+# Background render jobs: JOB_EXECUTOR=thread|process, JOB_WORKERS pool size, JOB_QUEUE_SIZE waiting slots
+# SFX_PREFETCH=1 warms the SFX library (download, index, pre-decode) in the background at startup
+if os.getenv('SFX_PREFETCH', '0') == '1':
+    threading.Thread(target=lambda: AudioProcessor(ffmpeg_bin=FFMPEG_BIN).sfx.prefetch(SFX_CUES), daemon=True).start()
+jobs = JobManager(
+    ffmpeg_bin=FFMPEG_BIN,
+    max_workers=int(os.getenv('JOB_WORKERS', '2')),
+    max_queue=int(os.getenv('JOB_QUEUE_SIZE', '8')),
+    executor=os.getenv('JOB_EXECUTOR', 'thread'),
+    jobs_dir=os.getenv('JOBS_DIR') or None,
+)
+# Live preview (GET /jobs/<id>/preview): PREVIEW_LINES quick clips at PREVIEW_BITRATE while the job renders
+PREVIEW_LINES = int(os.getenv('PREVIEW_LINES', '4'))
+PREVIEW_BITRATE = os.getenv('PREVIEW_BITRATE', '64k')
+# Finished stories by normalized text + voices + settings (RESULT_CACHE_DIR= disables), evicted by
+# size (RESULT_CACHE_MAX_MB) and age (RESULT_CACHE_MAX_AGE_H); identical concurrent requests share one render
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', 'result_cache')
+results = ResultCache(
+    RESULT_CACHE_DIR,
+    max_bytes=int(os.getenv('RESULT_CACHE_MAX_MB', '1024')) * 1024 * 1024,
+    max_age=float(os.getenv('RESULT_CACHE_MAX_AGE_H', '168')) * 3600,
+) if RESULT_CACHE_DIR else None
+# what /results serves: stories in the configured codec or streamed MP3, and their timing sidecars
+RESULT_EXTS = {dsp.CODECS.get(os.getenv('OUTPUT_CODEC', 'mp3'), ('.mp3',))[0], '.mp3', '.timing.json'}
 
 def split_story_into_chunks(story_text, max_chunk_length=950):
     sentences = re.split(r'(?<=[.!?]) +', story_text)
@@ -24,6 +66,87 @@ def split_story_into_chunks(story_text, max_chunk_length=950):
         chunks.append(current.strip())
     return chunks
 
+def pump(stream, blocks, block_size=64 * 1024):
+    """Copy a pipe into a queue block by block, then None at EOF."""
+    for block in iter(lambda: stream.read1(block_size), b''):
+        blocks.put(block)
+    blocks.put(None)
+
+def stream_chunks(proc, chunks, chunk_outs, work_dir, timing_out=None):
+    """Render chunks in order and yield the story's MP3 frames as each finished chunk is encoded.
+
+    All chunks feed one encoder, so the stream has a single encoder delay and padding and no
+    Info frame or gap at chunk boundaries. Once the stream is complete, the chunks' timing is
+    merged into timing_out's sidecar if given.
+    """
+    encoder = dsp.open_encoder(proc.ffmpeg, 'stream.mp3', proc.bitrate, pipe=True)
+    proc.profiler.count('subprocesses')
+    blocks = queue.Queue()
+    threading.Thread(target=pump, args=(encoder.stdout, blocks), daemon=True).start()
+    try:
+        with closing(proc.iter_chunks(chunks, chunk_outs, os.path.join(work_dir, 'segments'))) as rendered:
+            for path in rendered:
+                with proc.profiler.stage('encode'):
+                    encoder.stdin.write(np.ascontiguousarray(proc.decode(path), dtype=np.float32).tobytes())
+                os.remove(path)
+                while not blocks.empty():
+                    block = blocks.get()
+                    if block is None:
+                        # the encoder stopped early; leave the marker for the final drain
+                        blocks.put(None)
+                        break
+                    yield block
+        encoder.stdin.close()
+        yield from iter(blocks.get, None)
+        if encoder.wait():
+            raise subprocess.CalledProcessError(encoder.returncode, encoder.args)
+        if timing_out:
+            merge_timing(chunk_outs, timing_out)
+        proc.write_report(chunks=len(chunks), streamed=True)
+    finally:
+        if encoder.poll() is None:
+            encoder.kill()
+            encoder.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def cache_stream(blocks, key, tmp):
+    """Pass a streamed render through while writing it to the result cache.
+
+    An unfinished stream, or one without a timing sidecar for tmp, is dropped rather than cached.
+    """
+    try:
+        with open(tmp, 'wb') as f:
+            for block in blocks:
+                f.write(block)
+                yield block
+    except BaseException:
+        results.abandon(key, tmp)
+        raise
+    if os.path.exists(timing_path(tmp)):
+        results.commit(key, '.mp3', tmp)
+    else:
+        results.abandon(key, tmp)
+
+def render_story(proc, chunks, final_out):
+    """Render chunks into final_out in a private work dir (the non-streaming path)."""
+    # Per-request work dir so concurrent renders never share temp files
+    work_dir = tempfile.mkdtemp(prefix='audio5d_')
+    try:
+        # Chunks stay lossless (WAV) and are encoded once into the final file
+        chunk_outs = [os.path.join(work_dir, f'chunk_{i}.wav') for i in range(len(chunks))]
+        # All chunks share one concurrent TTS stage
+        proc.process_chunks(chunks, chunk_outs, os.path.join(work_dir, 'segments'))
+        # Concatenate all chunk outputs into the final file
+        proc.concat_files(chunk_outs, final_out)
+        proc.write_report(chunks=len(chunks))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return final_out
+
+def send_result(path):
+    """Redirect to a cached story, which /results serves from disk with conditional and range requests."""
+    return redirect(url_for('result', name=os.path.basename(path)), code=303)
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -33,48 +156,171 @@ def index():
             return redirect(url_for('index'))
         # Split into TTS-safe chunks
         chunks = split_story_into_chunks(story_text, max_chunk_length=950)
-        ffmpeg = r"ffmpeg-master-latest-win64-gpl-shared\bin\ffmpeg.exe"
-        proc = AudioProcessor(ffmpeg_bin=ffmpeg)
-        temp_files = []
-        for i, chunk in enumerate(chunks):
-            with tempfile.NamedTemporaryFile('w+', delete=False, suffix='.txt') as tf:
-                tf.write(chunk)
-                tf_path = tf.name
-            output_path = tf_path.replace('.txt', f'_chunk_{i}.mp3')
-            proc.process_story(chunk, "temp_audio", output_path)
-            temp_files.append(output_path)
-        # Concatenate all chunk outputs into the final file
-        if temp_files:
-            concat_file = "concat_list.txt"
-            with open(concat_file, "w", encoding="utf-8") as f:
-                for tf in temp_files:
-                    f.write(f"file '{tf}'\n")
-            final_out = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3').name
-            os.system(f'"{ffmpeg}" -y -f concat -safe 0 -i {concat_file} -c copy {final_out}')
-            # Clean up temp files
-            for tf in temp_files:
-                try:
-                    os.remove(tf)
-                except Exception:
-                    pass
-            try:
-                os.remove(concat_file)
-            except Exception:
-                pass
+        if not chunks:
+            flash('Audio generation failed.', 'danger')
+            return redirect(url_for('index'))
+        proc = AudioProcessor(ffmpeg_bin=FFMPEG_BIN)
+        stream = request.form.get('stream') == '1' or request.args.get('stream') == '1'
+        key = None
+        if results is not None:
+            key = results.key(story_text, proc.voices, {
+                'backend': proc.backend, 'tts': proc.tts.name, 'codec': proc.codec, 'bitrate': proc.bitrate,
+                'seed': proc.seed, 'max_chunk_length': 950,
+            })
+        if stream:
+            # Streaming mode: time-to-first-audio tracks the first chunk, not the whole story.
+            # Chunks stay lossless (WAV) and are fed, in order, through one MP3 encoder whose output is streamed.
+            cached = results.get(key, '.mp3') if results is not None else None
+            if cached:
+                return send_result(cached)
+            leader = True
+            if results is not None:
+                future, leader = results.claim(key)
+                if not leader:
+                    # the same story is streaming to another client: wait for its file
+                    try:
+                        return send_result(future.result())
+                    except RenderAbandoned:
+                        pass
+            work_dir = tempfile.mkdtemp(prefix='audio5d_')
+            chunk_outs = [os.path.join(work_dir, f'chunk_{i}.wav') for i in range(len(chunks))]
+            if results is not None and leader:
+                tmp = results.temp_path(key, '.mp3')
+                blocks = cache_stream(stream_chunks(proc, chunks, chunk_outs, work_dir, timing_out=tmp), key, tmp)
+            else:
+                blocks = stream_chunks(proc, chunks, chunk_outs, work_dir)
+            response = Response(
+                stream_with_context(blocks),
+                mimetype='audio/mpeg',
+                headers={'Content-Disposition': 'inline; filename=immersive_story.mp3'}
+            )
+            if results is not None and leader:
+                # release waiters even if the client leaves before the stream starts
+                response.call_on_close(lambda: future.done() or results.abandon(key, tmp))
+            return response
+        if results is not None:
+            return send_result(results.render(key, proc.output_ext, lambda out: render_story(proc, chunks, out)))
+        work_dir = tempfile.mkdtemp(prefix='audio5d_')
+        try:
+            final_out = render_story(proc, chunks, os.path.join(work_dir, 'story' + proc.output_ext))
             with open(final_out, 'rb') as f:
                 audio_data = f.read()
             response = make_response(audio_data)
-            response.headers.set('Content-Type', 'audio/mpeg')
-            response.headers.set('Content-Disposition', 'inline; filename=immersive_story.mp3')
-            try:
-                os.remove(final_out)
-            except Exception:
-                pass
+            response.headers.set('Content-Type', dsp.mime_type(final_out))
+            response.headers.set('Content-Disposition', f'inline; filename=immersive_story{proc.output_ext}')
             return response
-        else:
-            flash('Audio generation failed.', 'danger')
-            return redirect(url_for('index'))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
     return render_template('index.html')
 
+@app.route('/results/<name>')
+def result(name):
+    """A cached story (<key><ext>) or its timing sidecar (<key>.timing.json), straight from disk."""
+    key, _, ext = name.partition('.')
+    # only finished entries: never a leader's partial <key>.<pid>.<thread>.tmp<ext>
+    if results is None or not re.fullmatch(r'[0-9a-f]{64}', key) or '.' + ext not in RESULT_EXTS:
+        return jsonify({'error': 'Unknown result.'}), 404
+    if ext == 'timing.json':
+        path = os.path.join(results.cache_dir, name)
+        if not os.path.exists(path):
+            return jsonify({'error': 'Unknown result.'}), 404
+        return send_file(path, mimetype='application/json', conditional=True)
+    path = results.get(key, '.' + ext)
+    if path is None:
+        return jsonify({'error': 'Unknown result.'}), 404
+    # a key always names the same audio, so clients may keep it
+    return send_file(path, mimetype=dsp.mime_type(path), download_name=f'immersive_story.{ext}',
+                     conditional=True, max_age=86400)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    data = request.get_json(silent=True) or request.form
+    story_text = data.get('story_text')
+    if not story_text or len(story_text.strip()) < 10:
+        return jsonify({'error': 'Please enter a valid story.'}), 400
+    try:
+        job = jobs.submit(split_story_into_chunks(story_text, max_chunk_length=950))
+    except QueueFullError as e:
+        # Backpressure: tell the client to retry instead of queueing without bound
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    return jsonify(jobs.status(job.id)), 202, {'Location': url_for('job_status', job_id=job.id)}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job.'}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job.'}), 404
+    if job.status != 'done':
+        return jsonify(jobs.status(job_id)), 409
+    return send_file(job.output, mimetype=dsp.mime_type(job.output),
+                     download_name='immersive_story' + os.path.splitext(job.output)[1])
+
+@app.route('/jobs/<job_id>/timing')
+def job_timing(job_id):
+    """Start/end of every line in the rendered story, for seeking and highlighting in the player."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job.'}), 404
+    if job.status != 'done':
+        return jsonify(jobs.status(job_id)), 409
+    return send_file(timing_path(job.output), mimetype='application/json')
+
+def sse(event, data, event_id=None):
+    return (f"id: {event_id}\n" if event_id else "") + f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def preview_events(job, preview=True):
+    """The job's first lines as quick preview clips, then its progress until the full render is done."""
+    if preview and jobs.status(job.id)['status'] in ('queued', 'running'):
+        proc = AudioProcessor(ffmpeg_bin=FFMPEG_BIN, codec='mp3', bitrate=PREVIEW_BITRATE)
+        work_dir = tempfile.mkdtemp(prefix='audio5d_preview_')
+        try:
+            for seg, path in proc.iter_preview(job.chunks[0], work_dir, PREVIEW_LINES, seed=job.seed):
+                with open(path, 'rb') as f:
+                    audio = base64.b64encode(f.read()).decode('ascii')
+                yield sse('preview', {'index': seg['index'], 'role': seg['role'], 'text': seg['text'],
+                                      'audio': f'data:audio/mpeg;base64,{audio}'}, event_id=f"preview-{seg['index']}")
+            proc.write_report(job_id=job.id, preview=True)
+        except Exception as e:
+            # the full render carries on; the client just waits for it
+            logger.error("Preview of job %s failed: %s", job.id, e)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    while True:
+        status = jobs.status(job.id)
+        if status['status'] not in ('queued', 'running'):
+            break
+        yield sse('progress', status, event_id='progress')
+        time.sleep(1.0)
+    if status['status'] == 'done':
+        status.update(download=url_for('job_download', job_id=job.id), timing=url_for('job_timing', job_id=job.id))
+        yield sse('done', status)
+    else:
+        yield sse('failed', status)
+
+@app.route('/jobs/<job_id>/preview')
+def job_preview(job_id):
+    """Server-sent events for a job: 'preview' clips of its first lines, 'progress', then 'done' or 'failed'.
+
+    A reconnecting EventSource (Last-Event-ID set) gets the progress events only.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job.'}), 404
+    preview = 'Last-Event-ID' not in request.headers
+    return Response(stream_with_context(preview_events(job, preview)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics():
+    """Stage timings, counters and HTTP latency of every render in this process, Prometheus text format."""
+    return Response(METRICS.prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True)
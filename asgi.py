@@ -0,0 +1,177 @@
+"""ASGI serving path: run with any ASGI server, e.g. `uvicorn asgi:app`.
+
+POST /render renders a story (form-encoded or JSON `story_text`) and returns the audio;
+GET /metrics is the same Prometheus text as the Flask app's. Renders run as asyncio tasks
+(async_processor.py), so one process serves many at once without a thread per request.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+from urllib.parse import parse_qs
+
+from dotenv import load_dotenv
+
+import dsp
+from async_processor import AsyncAudioProcessor, make_http_client
+from audio_processor import AudioProcessor
+from instrumentation import METRICS
+from main import split_story_into_chunks
+
+load_dotenv()
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", r"ffmpeg-master-latest-win64-gpl-shared\bin\ffmpeg.exe")
+# renders in flight before new ones get 503 + Retry-After (ffmpeg processes are capped by effects_scheduler)
+MAX_RENDERS = int(os.getenv('ASGI_MAX_RENDERS', '16'))
+MAX_BODY = 1024 * 1024
+
+_renders = 0
+# built once (lifespan startup, or the first render) and shared by every render on the loop
+_proc = None
+_http = None
+_startup_lock = asyncio.Lock()
+
+
+async def _startup():
+    """Create the shared processor (caches, SFX library, cue matcher) and HTTP client."""
+    global _proc, _http
+    async with _startup_lock:
+        if _proc is None:
+            proc = await asyncio.to_thread(AudioProcessor, ffmpeg_bin=FFMPEG_BIN)
+            _http = make_http_client(proc, METRICS)
+            _proc = proc
+
+
+async def _shutdown():
+    global _proc, _http
+    if _http is not None:
+        await _http.close()
+    _proc = _http = None
+
+
+async def _respond(send, status, body=b'', content_type='application/json', headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode()), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _json(send, status, data, headers=()):
+    await _respond(send, status, json.dumps(data).encode(), headers=headers)
+
+
+async def _send_file(send, path, filename, block_size=64 * 1024):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', dsp.mime_type(path).encode()),
+        (b'content-length', str(os.path.getsize(path)).encode()),
+        (b'content-disposition', f'inline; filename={filename}'.encode()),
+    ]})
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            await send({'type': 'http.response.body', 'body': block, 'more_body': bool(block)})
+            if not block:
+                break
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY:
+            raise ValueError("Request body too large.")
+        if not message.get('more_body'):
+            return body
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def _story_text(scope, body):
+    content_type = dict(scope['headers']).get(b'content-type', b'').decode()
+    if content_type.startswith('application/json'):
+        return (json.loads(body or b'{}') or {}).get('story_text')
+    return (parse_qs(body.decode('utf-8')).get('story_text') or [None])[0]
+
+
+async def render(scope, receive, send):
+    """POST /render: render the story and send the file. A client disconnect cancels the render."""
+    global _renders
+    try:
+        body = await _read_body(receive)
+        if body is None:
+            return
+        story_text = _story_text(scope, body)
+    except ValueError as e:
+        return await _json(send, 400, {'error': str(e)})
+    if not story_text or len(story_text.strip()) < 10:
+        return await _json(send, 400, {'error': 'Please enter a valid story.'})
+    if _renders >= MAX_RENDERS:
+        return await _json(send, 503, {'error': 'Too many renders in progress, try again later.'},
+                           headers=[(b'retry-after', b'30')])
+    _renders += 1
+    work_dir = renderer = None
+    try:
+        # Per-request work dir so concurrent renders never share temp files
+        work_dir = tempfile.mkdtemp(prefix='audio5d_')
+        try:
+            await _startup()
+            proc = _proc.for_render()
+            renderer = AsyncAudioProcessor(proc, http=_http.bound_to(proc.profiler))
+        except Exception as e:
+            logger.error("Render setup failed: %s", e)
+            return await _json(send, 500, {'error': 'Audio generation failed.'})
+        # same TTS-safe chunks as the Flask app, planned and joined the same way
+        chunks = split_story_into_chunks(story_text, max_chunk_length=950)
+        final_out = os.path.join(work_dir, 'story' + renderer.proc.output_ext)
+        task = asyncio.ensure_future(
+            renderer.process_chunks(chunks, final_out, os.path.join(work_dir, 'segments')))
+        disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+        await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            logger.info("Client disconnected, render cancelled")
+            return
+        disconnect.cancel()
+        try:
+            task.result()
+        except Exception as e:
+            logger.error("Render failed: %s", e)
+            return await _json(send, 500, {'error': 'Audio generation failed.'})
+        await asyncio.to_thread(renderer.proc.write_report, chunks=len(chunks), asgi=True)
+        await _send_file(send, final_out, 'immersive_story' + renderer.proc.output_ext)
+    finally:
+        _renders -= 1
+        if renderer is not None:
+            await renderer.close()
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await _startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await _shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    if scope['path'] == '/render' and scope['method'] == 'POST':
+        return await render(scope, receive, send)
+    if scope['path'] == '/metrics' and scope['method'] == 'GET':
+        return await _respond(send, 200, METRICS.prometheus().encode(), 'text/plain; version=0.0.4')
+    await _json(send, 404, {'error': 'Not found.'})
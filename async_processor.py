@@ -0,0 +1,256 @@
+import asyncio
+import contextlib
+import logging
+import os
+import subprocess
+import time
+
+import dsp
+from audio_processor import AudioProcessor, FREESOUND_QUERIES
+from http_client import AsyncHttpClient
+from tts_backends import UnrealSpeechBackend
+
+logger = logging.getLogger(__name__)
+
+
+def make_http_client(proc, profiler=None):
+    """An AsyncHttpClient with proc's pool size, timeouts and retries."""
+    return AsyncHttpClient(
+        pool_size=proc.max_in_flight + 2,
+        timeout=proc.http.timeout,
+        retries=proc.http.retries,
+        profiler=profiler or proc.profiler,
+    )
+
+
+def _write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+class AsyncAudioProcessor:
+    """asyncio orchestration of AudioProcessor.process_story, for the ASGI app (asgi.py).
+
+    Planning, cues, caches and effect settings come from the wrapped AudioProcessor. TTS and Freesound
+    go through an AsyncHttpClient, ffmpeg runs as asyncio subprocesses and the numpy DSP runs on the
+    shared scheduler's process pool, so a render holds no thread while it waits. ffmpeg processes take
+    the scheduler's host-wide slots like every other path. `http` is an AsyncHttpClient (see
+    make_http_client) shared by every render on the loop; a client is only created, and closed by
+    close(), when none is passed. Cancelling process_story cancels its requests and kills its ffmpeg
+    children.
+    """
+
+    def __init__(self, proc=None, http=None, **kwargs):
+        self.proc = proc or AudioProcessor(**kwargs)
+        self.profiler = self.proc.profiler
+        self.tts_slots = asyncio.Semaphore(self.proc.max_in_flight)
+        self._owns_http = http is None
+        self.http = http or make_http_client(self.proc, self.profiler)
+
+    @contextlib.asynccontextmanager
+    async def ffmpeg_slot(self):
+        """Hold one of the scheduler's host-wide ffmpeg slots, polling for it without blocking the loop."""
+        slots = self.proc.scheduler.ffmpeg_slots
+        handle = slots.acquire(blocking=False)
+        while handle is None:
+            await asyncio.sleep(slots.poll)
+            handle = slots.acquire(blocking=False)
+        try:
+            yield
+        finally:
+            slots.release(handle)
+
+    async def run(self, cmd, input=None):
+        """Run ffmpeg under the host-wide slot cap; the process is killed if the render is cancelled."""
+        async with self.ffmpeg_slot():
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[FFMPEG CMD] %s", ' '.join(str(c) for c in cmd))
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            self.profiler.count('subprocesses')
+            try:
+                _, stderr = await process.communicate(input)
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+    async def text_to_mp3(self, seg):
+        """Async twin of AudioProcessor.text_to_mp3 for Unreal Speech (same cache), writing seg['raw']."""
+        proc = self.proc
+        start = time.perf_counter()
+        key, body = proc.tts_request(seg['text'], seg['voice'], seg['speed'], seg['pitch'], seg['volume'])
+
+        async def request():
+            async with self.tts_slots:
+                await asyncio.sleep(proc.rate_limiter.reserve())
+                resp = await self.http.post(
+                    proc.tts_url,
+                    endpoint="unrealspeech",
+                    headers={"Authorization": f"Bearer {proc.api_key}"},
+                    json=body,
+                )
+            resp.raise_for_status()
+            return resp.content
+
+        content, fetched = await proc.tts_cache.afetch(key, request) if key else (await request(), True)
+        self.profiler.count('tts_cache_misses' if fetched else 'tts_cache_hits')
+        await asyncio.to_thread(_write, seg['raw'], content)
+        self.profiler.add_stage('tts', time.perf_counter() - start, 0.0, 0, len(content))
+
+    async def fetch_sfx_from_freesound(self, query, out_path):
+        """Async twin of AudioProcessor.fetch_sfx_from_freesound. Returns True if out_path was written."""
+        api_key = os.getenv("FREESOUND_API_KEY")
+        if not api_key:
+            logger.warning("Freesound API key not set. Set FREESOUND_API_KEY in your .env file.")
+            return False
+        search_term = FREESOUND_QUERIES.get(query, query)
+        headers = {"Authorization": f"Token {api_key}"}
+        params = {"query": search_term, "fields": "id,name,previews,license", "page_size": 1}
+        start = time.perf_counter()
+        try:
+            resp = await self.http.get(f"{self.proc.freesound_url}/search/text/", endpoint="freesound_search",
+                                       headers=headers, params=params, timeout=10)
+            resp.raise_for_status()
+            results = resp.json().get("results", [])
+            if not results:
+                logger.warning("No SFX found for '%s' on Freesound.", search_term)
+                return False
+            sfx_data = await self.http.get(results[0]["previews"]["preview-hq-mp3"],
+                                           endpoint="freesound_preview", timeout=10)
+            sfx_data.raise_for_status()
+        except Exception as e:
+            logger.error("Error fetching SFX from Freesound: %s", e)
+            return False
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        # write aside and swap in: other renders may be reading the library
+        tmp = f"{out_path}.{os.getpid()}.{id(self)}.tmp"
+        await asyncio.to_thread(_write, tmp, sfx_data.content)
+        os.replace(tmp, out_path)
+        self.profiler.add_stage('sfx_fetch', time.perf_counter() - start, 0.0, 0, len(sfx_data.content))
+        logger.info("Downloaded SFX for '%s' to %s", search_term, out_path)
+        return True
+
+    async def resolve_sfx(self, segments):
+        """Fetch the missing SFX and ambience of a plan concurrently, then drop what is still unavailable."""
+        sfx = self.proc.sfx
+        paths = {p for seg in segments for p in (seg['effects'].get('sfx_path') or []) + seg.get('ambient', [])}
+
+        async def ensure(cue):
+            path = sfx.path(cue)
+            if not os.path.exists(path) and not sfx.offline:
+                await self.fetch_sfx_from_freesound(cue, path)
+            if os.path.exists(path):
+                # indexing decodes the clip once into the library's PCM; keep it off the loop
+                await asyncio.to_thread(sfx.get, cue)
+
+        await asyncio.gather(*(ensure(os.path.splitext(os.path.basename(p))[0]) for p in paths))
+        for seg in segments:
+            seg['effects']['sfx_path'] = [p for p in seg['effects'].get('sfx_path') or [] if os.path.exists(p)]
+            if 'ambient' in seg:
+                seg['ambient'] = [p for p in seg['ambient'] if os.path.exists(p)]
+
+    async def render_segment(self, seg):
+        """Async twin of AudioProcessor.render_segment, for SFX already resolved by resolve_sfx."""
+        proc = self.proc
+        effects = dict(seg['effects'])
+        sfx_paths = effects.pop('sfx_path', None) or []
+        if proc.backend == 'numpy':
+            # sfx_source may decode the cue (under the library's lock), so not on the loop
+            sfx_sources = await asyncio.gather(*(asyncio.to_thread(proc.sfx_source, p) for p in sfx_paths))
+            # the pool worker holds the ffmpeg slot while it runs
+            wall, cpu = await asyncio.wrap_future(proc.scheduler.submit_process(
+                dsp.render_effects_file, proc.ffmpeg, seg['raw'], seg['out'], effects, sfx_sources, proc.bitrate))
+            self.profiler.count('subprocesses')
+        else:
+            start = time.perf_counter()
+            await self.run(proc.effects_command(seg['raw'], seg['out'], sfx_path=sfx_paths, **effects))
+            wall, cpu = time.perf_counter() - start, 0.0
+        self.profiler.add_stage('effects', wall, cpu, os.path.getsize(seg['raw']), os.path.getsize(seg['out']))
+        seg['rendered'] = True
+
+    async def render_segments(self, segments, final_out):
+        """Join rendered segments in line order into final_out, with its timing sidecar."""
+        proc = self.proc
+        if proc.backend == 'numpy':
+            # in-memory pan/ambience and the single encode, in a worker thread
+            return await asyncio.to_thread(proc.render_segments, segments, final_out)
+        ordered = sorted(segments, key=lambda s: s['index'])
+        ambient = list(dict.fromkeys(p for seg in ordered for p in seg.get('ambient', ())))
+        lengths, gains = await asyncio.to_thread(proc.segment_gains, ordered)
+        start = time.perf_counter()
+        await self.run(proc.concat_command([seg['out'] for seg in ordered], final_out,
+                                           proc.pulsators(ordered, lengths), ambient, gains))
+        self.profiler.add_stage('concat', time.perf_counter() - start, 0.0, 0, os.path.getsize(final_out))
+        proc.write_timing(ordered, lengths, final_out)
+        logger.info("Done! Final audio -> %s", final_out)
+        return final_out
+
+    async def _render(self, segments):
+        """TTS then effects for every segment, each as its own task; on failure or cancellation the rest are stopped.
+
+        Only Unreal Speech is called from the loop; other TTS backends synthesize all the segments
+        in one batch on a worker thread first.
+        """
+        on_loop = isinstance(self.proc.tts, UnrealSpeechBackend)
+
+        async def render(seg):
+            if on_loop:
+                await self.text_to_mp3(seg)
+            await self.render_segment(seg)
+
+        await self.resolve_sfx(segments)
+        if not on_loop:
+            await asyncio.to_thread(self.proc.synthesize_segments, segments)
+        tasks = [asyncio.ensure_future(render(seg)) for seg in segments]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # stop the other segments before the work dir goes away
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def process_story(self, story_text, work_dir="temp", final_out="output.mp3", seed=None):
+        """Render one story: every segment's TTS then effects as its own task, then the join."""
+        start = time.perf_counter()
+        segments = await asyncio.to_thread(self.proc.plan_story, story_text, work_dir, seed=seed)
+        try:
+            await self._render(segments)
+            await self.render_segments(segments, final_out)
+        finally:
+            await asyncio.to_thread(self.proc.cleanup, work_dir)
+        self.profiler.add_stage('process_story', time.perf_counter() - start, 0.0, 0, os.path.getsize(final_out))
+        return final_out
+
+    async def process_chunks(self, chunks, final_out, work_dir="temp", seed=None):
+        """Render story chunks into final_out the way the Flask app does: each chunk is planned and joined
+        on its own (losslessly), then the chunks are encoded once into final_out.
+
+        Every segment of every chunk is in flight at once.
+        """
+        start = time.perf_counter()
+        plans = [await asyncio.to_thread(self.proc.plan_story, chunk, work_dir, prefix=f"chunk{i}_", seed=seed)
+                 for i, chunk in enumerate(chunks)]
+        if len(chunks) == 1:
+            chunk_outs = [final_out]
+        else:
+            chunk_outs = [os.path.join(work_dir, f'chunk_{i}{dsp.INTERMEDIATE_EXT}') for i in range(len(chunks))]
+        try:
+            await self._render([seg for segments in plans for seg in segments])
+            for segments, chunk_out in zip(plans, chunk_outs):
+                await self.render_segments(segments, chunk_out)
+            if len(chunks) > 1:
+                await asyncio.to_thread(self.proc.concat_files, chunk_outs, final_out)
+        finally:
+            await asyncio.to_thread(self.proc.cleanup, work_dir)
+        self.profiler.add_stage('process_story', time.perf_counter() - start, 0.0, 0, os.path.getsize(final_out))
+        return final_out
+
+    async def close(self):
+        if self._owns_http:
+            await self.http.close()
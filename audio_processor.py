@@ -1,100 +1,231 @@
+import copy
+import json
+import logging
 import os
-import subprocess
-import requests
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
 import shutil
+import dsp
+from tts_cache import TTSCache
+from tts_backends import TTSBackend, UnrealSpeechBackend, make_backend
+from http_client import HttpClient
+from sfx_library import SFXLibrary
+from cue_matcher import CueMatcher, default_cue_tables, AMBIENT_CUES, EMOTION_PARAMS, PAN_POSITIONS
+from instrumentation import METRICS, Profiler, profiled
+from effects_scheduler import SCHEDULER
+
+logger = logging.getLogger(__name__)
+
+# Map cue to better Freesound search terms
+FREESOUND_QUERIES = {
+    'rain': 'rain heavy rainstorm',
+    'forest': 'forest ambience birds',
+    'gate': 'gate creak open metal',
+    'battle': 'battle swords fight',
+    'storm': 'storm thunder',
+    'fire': 'fire crackling',
+    'crowd': 'crowd talking',
+    'wind': 'wind blowing',
+    'river': 'river stream water',
+    'beast': 'beast roar monster',
+}
+
+def timing_path(audio_path):
+    """The timing sidecar of an audio file: <name>.timing.json, each line's start/end in seconds."""
+    return os.path.splitext(audio_path)[0] + '.timing.json'
+
+
+def merge_timing(paths, final_out):
+    """Write final_out's timing sidecar from those of the files joined into it, if they all have one."""
+    if not paths or not all(os.path.exists(timing_path(p)) for p in paths):
+        return
+    lines, offset = [], 0.0
+    for chunk, path in enumerate(paths):
+        with open(timing_path(path), 'r', encoding='utf-8') as f:
+            timing = json.load(f)
+        for line in timing['lines']:
+            lines.append(dict(line, chunk=chunk, start=round(line['start'] + offset, 3),
+                              end=round(line['end'] + offset, 3)))
+        offset += timing['duration']
+    with open(timing_path(final_out), 'w', encoding='utf-8') as f:
+        json.dump({'duration': round(offset, 3), 'lines': lines}, f, indent=2)
+
+
+def copy_with_timing(src, dst):
+    shutil.copyfile(src, dst)
+    if os.path.exists(timing_path(src)):
+        shutil.copyfile(timing_path(src), timing_path(dst))
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart. rate=None disables it."""
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def reserve(self):
+        """Claim the next slot; returns how many seconds to wait before using it."""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        return start - now
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
 
 class AudioProcessor:
-    def __init__(self, api_key=None, ffmpeg_bin=None):
+    def __init__(self, api_key=None, ffmpeg_bin=None, max_in_flight=None, requests_per_second=None, tts_url=None,
+                 backend=None, cache_dir=None, seed=None, profiler=None, codec=None, bitrate=None, scheduler=None,
+                 tts=None):
         load_dotenv()
         self.api_key = api_key or os.getenv("UNREAL_SPEECH_API_KEY")
         # path to ffmpeg.exe
         self.ffmpeg = ffmpeg_bin or r"ffmpeg"  
+        # effects engine: 'ffmpeg' (subprocess filter chain per step) or 'numpy' (decode once, DSP in memory, encode once)
+        self.backend = backend or os.getenv("AUDIO_BACKEND", "ffmpeg")
+        if self.backend not in ('ffmpeg', 'numpy'):
+            raise ValueError(f"Unknown audio backend: {self.backend}")
+        # delivery format: stages pass float32 WAV between them and only the final file is encoded
+        self.codec = codec or os.getenv("OUTPUT_CODEC", "mp3")
+        if self.codec not in dsp.CODECS:
+            raise ValueError(f"Unknown output codec: {self.codec}")
+        self.bitrate = bitrate or os.getenv("OUTPUT_BITRATE", "256k")
+        self.output_ext = dsp.CODECS[self.codec][0]
+        # TTS endpoint (override to point at a local stub server)
+        self.tts_url = tts_url or os.getenv("UNREAL_SPEECH_URL", "https://api.v8.unrealspeech.com/stream")
+        # concurrent synthesis: max open TTS requests and optional requests/second cap
+        self.max_in_flight = max_in_flight or int(os.getenv("TTS_MAX_IN_FLIGHT", "4"))
+        rps = requests_per_second or os.getenv("TTS_REQUESTS_PER_SECOND")
+        self.rate_limiter = RateLimiter(float(rps) if rps else None)
+        # per-render stage timings and counters, also aggregated into METRICS for /metrics;
+        # RENDER_REPORT_DIR=<dir> writes each render's report there as JSON
+        self.profiler = profiler or Profiler(parent=METRICS)
+        self.report_dir = os.getenv("RENDER_REPORT_DIR")
+        # effects run on a core-sized pool shared by all renders in the process, which also caps ffmpeg processes
+        self.scheduler = scheduler or SCHEDULER
+        # pooled keep-alive client with timeouts and retry/backoff for TTS, Freesound (and Gemini in main.py)
+        self.http = HttpClient(
+            pool_size=self.max_in_flight + 2,
+            timeout=(float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")), float(os.getenv("HTTP_READ_TIMEOUT", "60"))),
+            retries=int(os.getenv("HTTP_RETRIES", "3")),
+            profiler=self.profiler,
+        )
+        self.freesound_url = os.getenv("FREESOUND_URL", "https://freesound.org/apiv2")
+        # persistent SFX library (SFX_OFFLINE=1 uses local assets only, never Freesound)
+        self.sfx = SFXLibrary(
+            root=os.getenv("SFX_LIBRARY_DIR", "sfx"),
+            ffmpeg=self.ffmpeg,
+            fetch=self.fetch_sfx_from_freesound,
+            offline=os.getenv("SFX_OFFLINE", "0") == "1",
+            run=self.run,
+        )
+        # content-addressed cache of TTS responses (TTS_CACHE_DIR="" disables it)
+        cache_dir = cache_dir if cache_dir is not None else os.getenv("TTS_CACHE_DIR", "tts_cache")
+        self.tts_bitrate = "256k"
+        self.tts_cache = TTSCache(cache_dir, int(os.getenv("TTS_CACHE_MAX_MB", "512")) * 1024 * 1024) if cache_dir else None
+        # seed for the pitch/volume/pan-rate jitter; None keeps it random per render
+        seed = seed if seed is not None else os.getenv("RENDER_SEED")
+        self.seed = seed
         # voices mapping
         self.voices = {
             'narrator': 'af_nicole',
             'male_character': 'am_michael',
             'female_character': 'af_bella'
         }
+        # speech engine: 'unreal' (Unreal Speech API) or 'local' (offline pyttsx3), or a TTSBackend instance
+        self.tts = tts if isinstance(tts, TTSBackend) else make_backend(tts or os.getenv("TTS_BACKEND", "unreal"), self)
+        self._matcher = None
+        self._matcher_roles = None
+
+    @property
+    def cue_matcher(self):
+        """Precompiled matcher for every cue table; rebuilt only if the voices map changes."""
+        roles = tuple(self.voices)
+        if self._matcher is None or self._matcher_roles != roles:
+            self._matcher = CueMatcher(default_cue_tables(self.voices))
+            self._matcher_roles = roles
+        return self._matcher
+
+    def for_render(self):
+        """A processor for one render that shares this one's caches, SFX library, HTTP pool, scheduler
+        and cue matcher, with its own profiler so the render's report covers only its own work.
+
+        The HTTP client and SFX library are rebound to the clone, so its HTTP latency and retries,
+        Freesound fetches and SFX indexing land in that report too.
+        """
+        self.cue_matcher  # build it once here rather than in every clone
+        clone = copy.copy(self)
+        clone.profiler = Profiler(parent=METRICS)
+        clone.http = self.http.bound_to(clone.profiler)
+        clone.sfx = self.sfx.bound_to(clone.run, clone.fetch_sfx_from_freesound)
+        if isinstance(self.tts, UnrealSpeechBackend):
+            clone.tts = UnrealSpeechBackend(clone)
+        return clone
+
+    def detect_cues(self, text):
+        """Scan text once and return the matched cues of every class (role, emotion, sfx, ambient, pan, reverb)."""
+        return self.cue_matcher.classify(text)
 
-    def extract_emotion_params(self, text):
+    def extract_emotion_params(self, text, cues=None):
         """Detect emotion cues, punctuation, and return TTS params: speed, pitch, volume."""
-        cues = [
-            (['shout', 'shouted', 'yelled', 'exclaimed', 'loudly', '!'], '0.25', '1.25', '1.3'),
-            (['whisper', 'whispered', 'softly', 'murmur', 'quietly'], '-0.25', '0.9', '0.7'),
-            (['sad', 'sadly', 'sorrow', 'cry', 'cried'], '-0.15', '0.8', '0.9'),
-            (['happy', 'happily', 'joy', 'excited', 'excitedly'], '0.12', '1.12', '1.1'),
-            (['angry', 'angrily', 'furious', 'rage'], '0.18', '1.18', '1.2'),
-            (['calm', 'calmly', 'serene', 'peaceful'], '-0.12', '1.0', '0.9'),
-        ]
-        lower = text.lower()
+        cues = cues or self.detect_cues(text)
         # Punctuation-based cues
         if text.strip().endswith('!'):
             return '0.25', '1.25', '1.3'
         if text.strip().endswith('...'):
             return '-0.15', '0.9', '0.8'
-        for keywords, speed, pitch, volume in cues:
-            if any(k in lower for k in keywords):
-                return speed, pitch, volume
+        if cues['emotion']:
+            return EMOTION_PARAMS[cues['emotion'][0]]
         # Question: slightly higher pitch
         if text.strip().endswith('?'):
             return '0.05', '1.15', '1.0'
         return '0', '1', '1'  # default: neutral
 
+    @profiled('tts')
     def text_to_mp3(self, text, voice_id, out_path, speed='0', pitch='1', volume='1'):
-        """Call Unreal Speech and write raw MP3 to out_path, with emotion params and optional pause."""
+        """Synthesize one line into out_path with the TTS backend (Unreal Speech by default), with emotion params.
+
+        The 0.3s pacing pause is added by the effects stage, so the clip is never re-encoded here.
+        """
+        self.tts.synthesize(text, voice_id, out_path, speed, pitch, volume)
+        self.profiler.add_bytes(bytes_out=os.path.getsize(out_path))
+
+    @profiled('tts')
+    def synthesize_batch(self, segments):
+        """Synthesize the raw clips of several segments in one TTS backend call."""
+        self.tts.synthesize_batch([(seg['text'], seg['voice'], seg['raw'], seg['speed'], seg['pitch'], seg['volume'])
+                                   for seg in segments])
+        self.profiler.add_bytes(bytes_out=sum(os.path.getsize(seg['raw']) for seg in segments))
+
+    def tts_request(self, text, voice_id, speed='0', pitch='1', volume='1'):
+        """TTS cache key (None without a cache) and Unreal Speech request body for one line."""
         # Add a short pause after each line for pacing
         if text and not text.strip().endswith(('.', '!', '?', '...')):
             text = text.strip() + '.'
-        resp = requests.post(
-            "https://api.v8.unrealspeech.com/stream",
-            headers={"Authorization": f"Bearer {self.api_key}"},
-            json={
-                "Text": text,
-                "VoiceId": voice_id,
-                "Bitrate": "256k",
-                "Speed": speed,
-                "Pitch": pitch,
-                "Volume": volume,
-                "Codec": "libmp3lame"
-            }
-        )
-        resp.raise_for_status()
-        with open(out_path, "wb") as f:
-            f.write(resp.content)
-        # Add a 0.3s silence after each segment for pacing
-        silence_path = out_path.replace('.mp3', '_silence.mp3')
-        cmd = [self.ffmpeg, '-nostdin', '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=stereo', '-t', '0.3', '-q:a', '9', '-acodec', 'libmp3lame', silence_path]
-        subprocess.run(cmd, check=True)
-        # Concatenate voice and silence
-        concat_path = out_path.replace('.mp3', '_withsilence.mp3')
-        cmd = [self.ffmpeg, '-nostdin', '-y', '-i', f"concat:{out_path}|{silence_path}", '-acodec', 'libmp3lame', '-b:a', '256k', concat_path]
-        subprocess.run(cmd, check=True)
-        os.remove(silence_path)
-        import time
-        for _ in range(10):
-            try:
-                os.replace(concat_path, out_path)
-                break
-            except PermissionError:
-                time.sleep(0.1)
-        else:
-            raise PermissionError(f"Could not replace {out_path} after several attempts.")
+        key = self.tts_cache.key(text, voice_id, speed, pitch, volume, self.tts_bitrate) if self.tts_cache else None
+        return key, {
+            "Text": text,
+            "VoiceId": voice_id,
+            "Bitrate": self.tts_bitrate,
+            "Speed": speed,
+            "Pitch": pitch,
+            "Volume": volume,
+            "Codec": "libmp3lame"
+        }
 
-    def detect_sfx_and_pan(self, text, role):
+    def detect_sfx_and_pan(self, text, role, cues=None):
         """Detect multiple SFX and pan direction from text and role. More robust cue matching and debug output."""
-        sfx_map = {
-            'rain': ['rain', 'raining', 'poured', 'pouring', 'downpour'],
-            'forest': ['forest', 'woods', 'trees'],
-            'gate': ['gate', 'door', 'creaked', 'opened'],
-            'battle': ['battle', 'fight', 'sword', 'combat'],
-            'storm': ['storm', 'thunder', 'lightning', 'tempest', 'rumbled'],
-            'fire': ['fire', 'flame', 'burn', 'crackled'],
-            'crowd': ['crowd', 'chanting', 'people', 'voices'],
-            'wind': ['wind', 'howled', 'gust'],
-            'river': ['river', 'stream', 'water', 'rushing'],
-            'beast': ['beast', 'roared', 'monster', 'growl'],
-        }
+        cues = cues or self.detect_cues(text)
         pan_map = {
             'narrator': 0.0,
             'male_character': -0.5,  # left
@@ -102,244 +233,557 @@ class AudioProcessor:
         }
         sfx_list = []
         pan = pan_map.get(role, 0.0)
-        lower = text.lower()
-        for cue, keywords in sfx_map.items():
-            if any(word in lower for word in keywords):
-                sfx_path = f'sfx/{cue}.mp3'
-                sfx_list.append(sfx_path)
-                print(f"[SFX DETECTED] '{cue}' in line: {text.strip()}")
-        # Pan cues
-        if 'left' in lower:
-            pan = -1.0
-        elif 'right' in lower:
-            pan = 1.0
-        elif 'behind' in lower:
-            pan = 0.0  # center, but could add reverb
+        for cue in cues['sfx']:
+            sfx_path = self.sfx.path(cue)
+            sfx_list.append(sfx_path)
+            logger.debug("[SFX DETECTED] '%s' in line: %s", cue, text.strip())
+        # Pan cues ('behind' stays centered, but could add reverb)
+        if cues['pan']:
+            pan = PAN_POSITIONS[cues['pan'][0]]
         return sfx_list, pan
 
+    @profiled('effects')
     def apply_effects(self, in_path, out_path,
                       pan_rate=0.2,
                       reverb_in_gain=0.8, reverb_out_gain=0.9,
                       reverb_delays="60|60", reverb_decays="0.4|0.3",
                       pan_pos=0.0, sfx_path=None):
         """
-        Uses FFmpeg:
+        Uses FFmpeg, in a single call:
+          - apad=pad_dur=0.3             → pacing pause after the line
           - apulsator=hz=<pan_rate>      → oscillating stereo pan
-          - pan=stereo|c0=<L>|c1=<R>     → static pan
+          - pan=stereo|c0=<L>|c1=<R>     → static pan (pan_pos=None: none, see render_segments)
           - aecho=<in_gain>:<out_gain>:<delays>:<decays>  → reverb
           - mixes in SFX if provided (now supports multiple SFX)
+        out_path's extension picks the format: .wav for a lossless intermediate, or a delivery codec.
+        With backend='numpy' the same chain runs in memory (see dsp.render_effects).
         """
-        # If SFX is requested but missing, try to fetch it from Freesound
-        sfx_paths = sfx_path if isinstance(sfx_path, list) else ([sfx_path] if sfx_path else [])
-        for sfx in sfx_paths:
-            if sfx and not os.path.exists(sfx):
-                cue = os.path.splitext(os.path.basename(sfx))[0]
-                print(f"SFX '{sfx}' not found. Attempting to fetch from Freesound...")
-                self.fetch_sfx_from_freesound(cue, sfx)
-        # Pan filter: static if pan_pos set, else oscillating
-        if pan_pos != 0.0:
+        sfx_paths = self.resolve_sfx(sfx_path)
+        self.profiler.add_bytes(bytes_in=os.path.getsize(in_path))
+        if self.backend == 'numpy':
+            voice = np.concatenate([self.decode(in_path), dsp.silence(0.3)])
+            samples = self.effects_numpy(voice, pan_rate=pan_rate,
+                                         reverb_in_gain=reverb_in_gain, reverb_out_gain=reverb_out_gain,
+                                         reverb_delays=reverb_delays, reverb_decays=reverb_decays,
+                                         pan_pos=pan_pos, sfx_path=sfx_paths)
+            self.encode(samples, out_path)
+            self.profiler.add_bytes(bytes_out=os.path.getsize(out_path))
+            return
+        cmd = self.effects_command(in_path, out_path, pan_rate=pan_rate,
+                                   reverb_in_gain=reverb_in_gain, reverb_out_gain=reverb_out_gain,
+                                   reverb_delays=reverb_delays, reverb_decays=reverb_decays,
+                                   pan_pos=pan_pos, sfx_path=sfx_paths)
+        self.run(cmd, check=True)
+        self.profiler.add_bytes(bytes_out=os.path.getsize(out_path))
+
+    def effects_command(self, in_path, out_path,
+                        pan_rate=0.2,
+                        reverb_in_gain=0.8, reverb_out_gain=0.9,
+                        reverb_delays="60|60", reverb_decays="0.4|0.3",
+                        pan_pos=0.0, sfx_path=()):
+        """The ffmpeg command line of apply_effects, for already resolved SFX files."""
+        # Pan filter: static if pan_pos set, else oscillating; None leaves it to the join (narration)
+        if pan_pos is None:
+            pan_filter = "aformat=channel_layouts=stereo"
+        elif pan_pos != 0.0:
             l = max(0.0, 1.0 - pan_pos)
             r = max(0.0, 1.0 + pan_pos)
             pan_filter = f"pan=stereo|c0={l}*c0|c1={r}*c1"
         else:
             pan_filter = f"apulsator=hz={pan_rate}"
         reverb_filter = f"aecho={reverb_in_gain}:{reverb_out_gain}:{reverb_delays}:{reverb_decays}"
-        filter_chain = f"{pan_filter},{reverb_filter},loudnorm"
-        # If SFX, first apply pan/reverb to main audio, then mix with SFX
+        # no loudnorm here: levels are set for all segments at once when they are joined (render_segments)
+        filter_chain = f"apad=pad_dur=0.3,{pan_filter},{reverb_filter}"
+        sfx_paths = [s for s in sfx_path if os.path.exists(s)]
+        # library SFX are read as their pre-decoded PCM, like the numpy backend
+        inputs = ['-i', in_path] + sum([dsp.pcm_input_args(self.sfx_source(s)) for s in sfx_paths], [])
         if sfx_paths:
-            # Step 1: Process main audio with pan/reverb to a temp file
-            temp_panned = in_path.replace('.mp3', '_panned.mp3')
-            pan_cmd = [
-                self.ffmpeg, '-nostdin', '-y', '-i', in_path,
-                '-af', filter_chain,
-                '-codec:a', 'libmp3lame', '-b:a', '256k',
-                temp_panned
-            ]
-            print(f"[FFMPEG CMD] {' '.join(str(c) for c in pan_cmd)})")
-            subprocess.run(pan_cmd, check=True)
-            # Step 2: Mix panned main audio with SFX
-            inputs = ['-i', temp_panned] + sum([[f'-i', s] for s in sfx_paths if os.path.exists(s)], [])
-            amix_inputs = 1 + len([s for s in sfx_paths if os.path.exists(s)])
-            narration_boost = '[0:a]volume=3.0[voice]'  # extreme boost for narrator
-            sfx_volumes = [f'[{i+1}:a]volume=0.02[sfx{i}]' for i in range(amix_inputs-1)]
+            # pan/reverb the voice and mix it with the SFX in one filter graph, no temp file
+            amix_inputs = 1 + len(sfx_paths)
+            voice = f'[0:a]{filter_chain}[voice]'
+            sfx_volumes = [f'[{i+1}:a]volume={dsp.AMBIENCE_GAIN}[sfx{i}]' for i in range(amix_inputs-1)]
             sfx_labels = ''.join([f'[sfx{i}]' for i in range(amix_inputs-1)])
             filter_complex = (
-                narration_boost + ';' +
-                ('' if not sfx_volumes else ';'.join(sfx_volumes) + ';') +
-                f'[voice]{sfx_labels}amix=inputs={amix_inputs}:duration=first:dropout_transition=2[out]'
+                voice + ';' + ';'.join(sfx_volumes) + ';' +
+                f'[voice]{sfx_labels}amix=inputs={amix_inputs}:duration=first:dropout_transition=2:normalize=0[out]'
             )
-            cmd = [self.ffmpeg, '-nostdin', '-y'] + inputs + [
-                '-filter_complex', filter_complex,
-                '-map', '[out]',
-                '-codec:a', 'libmp3lame', '-b:a', '256k',
-                out_path
-            ]
-            print(f"[FFMPEG CMD] {' '.join(str(c) for c in cmd)})")
-            subprocess.run(cmd, check=True)
-            os.remove(temp_panned)
+            filter_args = ['-filter_complex', filter_complex, '-map', '[out]']
         else:
-            cmd = [
-                self.ffmpeg, '-nostdin', '-y', '-i', in_path,
-                '-af', filter_chain,
-                '-codec:a', 'libmp3lame', '-b:a', '256k',
-                out_path
-            ]
-            print(f"[FFMPEG CMD] {' '.join(str(c) for c in cmd)})")
-            subprocess.run(cmd, check=True)
-
-    def concat(self, segment_paths, final_out):
-        """Concatenate via ffmpeg concat demuxer."""
+            filter_args = ['-af', filter_chain]
+        return [self.ffmpeg, '-nostdin', '-y', *inputs, *filter_args,
+                *dsp.codec_args(out_path, self.bitrate), out_path]
+
+    def resolve_sfx(self, sfx_path):
+        """Normalize sfx_path to a list of available files, pulling missing cues into the SFX library."""
+        sfx_paths = sfx_path if isinstance(sfx_path, list) else ([sfx_path] if sfx_path else [])
+        resolved = []
+        for sfx in sfx_paths:
+            if sfx and not os.path.exists(sfx):
+                sfx = self.sfx.get(os.path.splitext(os.path.basename(sfx))[0])
+            if sfx:
+                resolved.append(sfx)
+        return resolved
+
+    def _sfx_buffer(self, path):
+        """Pre-decoded PCM from the library for library files, otherwise a one-off decode."""
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.sfx.root):
+            pcm = self.sfx.pcm(os.path.splitext(os.path.basename(path))[0])
+            if pcm is not None:
+                return pcm
+        return self.decode(path)
+
+    def run(self, cmd, **kwargs):
+        """subprocess.run for ffmpeg: profiled, and waiting for a free slot under the FFMPEG_MAX_PROCS cap."""
+        with self.scheduler.ffmpeg_slots:
+            return self.profiler.run(cmd, **kwargs)
+
+    def decode(self, path):
+        return dsp.decode(self.ffmpeg, path, run=self.run)
+
+    def encode(self, samples, out_path):
+        dsp.encode(self.ffmpeg, samples, out_path, bitrate=self.bitrate, run=self.run)
+
+    def sfx_source(self, path):
+        """The library's pre-decoded .npy for library files, otherwise the file itself."""
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.sfx.root):
+            pcm_path = self.sfx.pcm_path(os.path.splitext(os.path.basename(path))[0])
+            if pcm_path is not None:
+                return pcm_path
+        return path
+
+    def effects_numpy(self, samples, sfx_path=None, **effects):
+        """Apply pan/reverb and SFX mix to a decoded buffer in memory."""
+        sfx_buffers = [self._sfx_buffer(s) for s in (sfx_path or []) if os.path.exists(s)]
+        return dsp.render_effects(samples, sfx_buffers=sfx_buffers, **effects)
+
+    @profiled('concat')
+    def concat(self, segment_paths, final_out, pulsators=None, ambient=(), gains=None):
+        """Concatenate segments with ffmpeg's concat filter, encoding to final_out's format.
+
+        gains are the segments' mastering gains; pulsators gives (pan rate, LFO phase) for segments
+        that get the 8D pan at the join, None for the rest; ambient beds are looped under the whole
+        result, which goes through one limiter.
+        """
+        self.run(self.concat_command(segment_paths, final_out, pulsators, ambient, gains), check=True)
+        self.profiler.add_bytes(bytes_out=os.path.getsize(final_out))
+
+    def concat_command(self, segment_paths, final_out, pulsators=None, ambient=(), gains=None):
+        """The ffmpeg command line of concat."""
         # Build input arguments
         input_args = []
+        filters = []
         filter_inputs = []
         for i, p in enumerate(segment_paths):
             input_args += ['-i', os.path.abspath(p)]
-            filter_inputs.append(f'[{i}:a]')
-        filter_complex = f'{"".join(filter_inputs)}concat=n={len(segment_paths)}:v=0:a=1[out]'
-        cmd = [
+            chain = [f'volume={gains[i]:.6f}'] if gains else []
+            pulsator = pulsators[i] if pulsators else None
+            if pulsator:
+                rate, phase = pulsator
+                chain.append(f'apulsator=hz={rate}:offset_l={phase % 1.0}:offset_r={(phase + 0.5) % 1.0}'
+                             f':level_out={dsp.PULSATOR_MAKEUP}')
+            if chain:
+                filters.append(f'[{i}:a]{",".join(chain)}[p{i}]')
+                filter_inputs.append(f'[p{i}]')
+            else:
+                filter_inputs.append(f'[{i}:a]')
+        filters.append(f'{"".join(filter_inputs)}concat=n={len(segment_paths)}:v=0:a=1[voice]')
+        beds = []
+        for j, bed in enumerate(ambient):
+            input_args += ['-stream_loop', '-1', *dsp.pcm_input_args(os.path.abspath(self.sfx_source(bed)))]
+            filters.append(f'[{len(segment_paths) + j}:a]volume={dsp.AMBIENCE_GAIN}[bed{j}]')
+            beds.append(f'[bed{j}]')
+        if beds:
+            filters.append(f'[voice]{"".join(beds)}amix=inputs={1 + len(beds)}:duration=first:normalize=0[mix]')
+        else:
+            filters[-1] = filters[-1].replace('[voice]', '[mix]')
+        # the one limiter of the mastering pass (see dsp.limit), delay-compensated so timings hold
+        window_ms = dsp.LIMITER_WINDOW * 1000
+        filters.append(f'[mix]alimiter=limit={10 ** (dsp.PEAK_CEILING_DB / 20):.6f}:attack={window_ms}'
+                       f':release={window_ms}:level=disabled:latency=1[out]')
+        return [
             self.ffmpeg, '-nostdin', '-y', *input_args,
-            '-filter_complex', filter_complex,
+            '-filter_complex', ';'.join(filters),
             '-map', '[out]',
-            '-acodec', 'libmp3lame', '-b:a', '256k',
+            *dsp.codec_args(final_out, self.bitrate),
             final_out
         ]
-        subprocess.run(cmd, check=True)
 
-    def get_ambient_sfx(self, story_text):
+    @profiled('concat')
+    def concat_files(self, paths, final_out):
+        """Join chunk files with the ffmpeg concat demuxer.
+
+        Lossless (WAV) chunks are encoded once into final_out's format; chunks already in that
+        format are joined with -c copy.
+        """
+        list_path = f"{final_out}.concat.txt"
+        with open(list_path, "w", encoding="utf-8") as f:
+            for p in paths:
+                f.write(f"file '{os.path.abspath(p)}'\n")
+        ext = os.path.splitext(final_out)[1].lower()
+        if all(os.path.splitext(p)[1].lower() == ext for p in paths):
+            codec = ['-c', 'copy']
+        else:
+            codec = dsp.codec_args(final_out, self.bitrate)
+        cmd = [self.ffmpeg, '-nostdin', '-y', '-f', 'concat', '-safe', '0', '-i', list_path, *codec, final_out]
+        try:
+            self.run(cmd, check=True)
+        finally:
+            os.remove(list_path)
+        self.profiler.add_bytes(bytes_out=os.path.getsize(final_out))
+        merge_timing(paths, final_out)
+        return final_out
+
+    def get_ambient_sfx(self, story_text, cues=None):
         """Detect ambient SFX (rain, forest, wind, etc.) that should persist for the whole story or scene."""
-        ambient_cues = ['rain', 'forest', 'wind', 'river', 'storm', 'crowd', 'fire']
-        lower = story_text.lower()
-        ambient_sfx = []
-        for cue in ambient_cues:
-            if cue in lower:
-                sfx_path = f'sfx/{cue}.mp3'
-                if sfx_path not in ambient_sfx:
-                    ambient_sfx.append(sfx_path)
-        return ambient_sfx
-
-    def process_story(self, story_text, work_dir="temp", final_out="output.mp3"):
+        cues = cues or self.detect_cues(story_text)
+        return [self.sfx.path(cue) for cue in cues['ambient']]
+
+    def _rng(self, seed, text):
+        """Jitter source for one segment: derived from (seed, text) so it is stable across runs and edits."""
+        if seed is None:
+            return random
+        return random.Random(f"{seed}:{text}")
+
+    def plan_story(self, story_text, work_dir="temp", prefix="", seed=None, ambience=True):
+        """Split a story into narrator/character segments with TTS params, file paths and effect settings.
+
+        ambience=False leaves the ambient beds out (long-form mode lays them over the whole timeline
+        instead, see longform.py).
+        """
+        seed = seed if seed is not None else self.seed
         os.makedirs(work_dir, exist_ok=True)
-        segment_files = []
-        import random
+        segments = []
         narrator_lines = []
         narrator_indices = []
+        narrator_cues = []
         char_segments = {}
         # 1) split lines and collect narrator/character lines
+        ambient_cues = set()
         for idx, line in enumerate([l.strip() for l in story_text.splitlines() if l.strip()]):
-            role = 'narrator'
-            lower = line.lower()
-            for key in self.voices:
-                if key in lower:
-                    role = key
-                    break
+            # one matcher pass per line covers role, emotion, SFX, ambience and pan
+            cues = self.detect_cues(line)
+            ambient_cues.update(cues['ambient'])
+            # the earliest role label in the line wins
+            role_matches = [m for m in cues['matches'] if m.kind == 'role']
+            role = role_matches[0].cue if role_matches else 'narrator'
             if role == 'narrator':
                 narrator_lines.append(line)
                 narrator_indices.append(idx)
+                narrator_cues.append(cues)
             else:
-                char_segments[idx] = (line, role)
-        # 2) Process narrator lines as one segment for smooth 8D pan
-        ambient_sfx = self.get_ambient_sfx(story_text)
-        narrator_sfx, _ = self.detect_sfx_and_pan(' '.join(narrator_lines), 'narrator') if narrator_lines else ([], 0.0)
-        combined_sfx = list(set(ambient_sfx + narrator_sfx))
-        if narrator_lines:
-            narrator_text = ' '.join(narrator_lines)
-            speed, pitch, volume = self.extract_emotion_params(narrator_text)
+                char_segments[idx] = (line, role, cues)
+        # 2) Narrator lines become one segment each, in their own place in the story, with their own
+        # voice jitter (seeded per line, so editing one line leaves the others' TTS untouched). They
+        # share one 8D pan rate, seeded from the render seed alone; the pan itself is applied at the
+        # join with a continuous phase (see render_segments), so the motion runs on smoothly from line to line.
+        ambient_sfx = [self.sfx.path(cue) for cue in AMBIENT_CUES if cue in ambient_cues] if ambience else []
+        pan_rate = self._rng(seed, 'narrator pan').uniform(0.13, 0.22)
+        for idx, line, cues in zip(narrator_indices, narrator_lines, narrator_cues):
+            speed, pitch, volume = self.extract_emotion_params(line, cues)
             # Add slight random pitch/volume for realism
-            pitch = str(float(pitch) + random.uniform(-0.04, 0.04))
-            volume = str(float(volume) + random.uniform(-0.05, 0.05))
-            raw_mp3 = os.path.join(work_dir, f"raw_narrator.mp3")
-            proc_mp3 = os.path.join(work_dir, f"fx_narrator.mp3")
-            self.text_to_mp3(narrator_text, self.voices['narrator'], raw_mp3, speed, pitch, volume)
-            pan_rate = random.uniform(0.13, 0.22)
+            rng = self._rng(seed, line)
+            pitch = str(float(pitch) + rng.uniform(-0.04, 0.04))
+            volume = str(float(volume) + rng.uniform(-0.05, 0.05))
+            sfx_list, _ = self.detect_sfx_and_pan(line, 'narrator', cues)
+            effects = dict(pan_pos=None, sfx_path=sfx_list)
             # Check for any special cues in narrator text
-            lower = narrator_text.lower()
-            if any(cue in lower for cue in ['behind', 'echo', 'distant', 'far away']):
-                reverb = True
-                extra_reverb = True
+            if cues['reverb']:
                 volume = str(float(volume) * 0.7)
-            else:
-                reverb = False
-                extra_reverb = False
-            if reverb or extra_reverb:
-                self.apply_effects(
-                    raw_mp3, proc_mp3,
-                    pan_pos=0.0, pan_rate=pan_rate, sfx_path=combined_sfx,
-                    reverb_in_gain=0.9 if extra_reverb else 0.8,
-                    reverb_out_gain=1.0 if extra_reverb else 0.9,
-                    reverb_delays="120|90" if extra_reverb else "60|60",
-                    reverb_decays="0.7|0.5" if extra_reverb else "0.4|0.3"
-                )
-            else:
-                self.apply_effects(raw_mp3, proc_mp3, pan_pos=0.0, pan_rate=pan_rate, sfx_path=combined_sfx)
-            # Split processed narrator audio into segments matching original narrator lines
-            # (Optional: advanced - for now, treat as one segment)
-            segment_files.append((min(narrator_indices), proc_mp3))
+                effects.update(reverb_in_gain=0.9, reverb_out_gain=1.0,
+                               reverb_delays="120|90", reverb_decays="0.7|0.5")
+            segments.append({
+                'index': idx,
+                'role': 'narrator',
+                'text': line,
+                'voice': self.voices['narrator'],
+                'speed': speed, 'pitch': pitch, 'volume': volume,
+                'raw': os.path.join(work_dir, f"{prefix}raw_{idx}{self.tts.ext}"),
+                'out': os.path.join(work_dir, f"{prefix}fx_{idx}{dsp.INTERMEDIATE_EXT}"),
+                'effects': effects,
+                'pulsator': pan_rate,
+                # ambient beds loop under the whole joined story
+                'ambient': ambient_sfx,
+            })
         # 3) Process character lines as before
         for idx in sorted(char_segments.keys()):
-            line, role = char_segments[idx]
-            speed, pitch, volume = self.extract_emotion_params(line)
-            sfx_list, pan = self.detect_sfx_and_pan(line, role)
-            pan_pos = pan
-            pan_rate = 0.2
-            raw_mp3 = os.path.join(work_dir, f"raw_{idx}.mp3")
-            proc_mp3 = os.path.join(work_dir, f"fx_{idx}.mp3")
-            self.text_to_mp3(line, self.voices[role], raw_mp3, speed, pitch, volume)
-            self.apply_effects(raw_mp3, proc_mp3, pan_pos=pan_pos, pan_rate=pan_rate, sfx_path=sfx_list)
-            segment_files.append((idx, proc_mp3))
-        # 4) Sort and concat all segments in original order
-        segment_files = [f for _, f in sorted(segment_files)]
-        self.concat(segment_files, final_out)
-        print(f"✨ Done! Final audio → {final_out}")
-        # Clean up temp_audio and sfx content
+            line, role, cues = char_segments[idx]
+            speed, pitch, volume = self.extract_emotion_params(line, cues)
+            sfx_list, pan = self.detect_sfx_and_pan(line, role, cues)
+            segments.append({
+                'index': idx,
+                'role': role,
+                'text': line,
+                'voice': self.voices[role],
+                'speed': speed, 'pitch': pitch, 'volume': volume,
+                'raw': os.path.join(work_dir, f"{prefix}raw_{idx}{self.tts.ext}"),
+                'out': os.path.join(work_dir, f"{prefix}fx_{idx}{dsp.INTERMEDIATE_EXT}"),
+                'effects': dict(pan_pos=pan, pan_rate=0.2, sfx_path=sfx_list),
+            })
+        return segments
+
+    def _groups(self, segments):
+        """Segments per TTS call: all of them for a batching backend, else one each."""
+        if not segments:
+            return []
+        return [segments] if self.tts.batch else [[seg] for seg in segments]
+
+    def synthesize_segments(self, segments):
+        """Run TTS for every segment concurrently, with at most max_in_flight requests open at once."""
+        groups = self._groups(segments)
+        if not groups:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_in_flight, len(groups)))) as pool:
+            futures = [pool.submit(self.synthesize_batch, group) for group in groups]
+            for future in futures:
+                future.result()
+
+    def _submit_segments(self, pool, segments, stop=None):
+        """TTS on `pool`, then each segment's effects on the shared scheduler as soon as its audio arrives.
+
+        Each returned future covers one TTS call (see _groups) and resolves to the effects futures of
+        its segments (none if `stop` was set first).
+        """
+        def synthesize_then_render(group):
+            self.synthesize_batch(group)
+            if stop is not None and stop.is_set():
+                return []
+            return [self.scheduler.submit(self.render_segment, seg) for seg in group]
+        return [pool.submit(synthesize_then_render, group) for group in self._groups(segments)]
+
+    @staticmethod
+    def _wait_segments(futures):
+        for future in futures:
+            for effects in future.result():
+                effects.result()
+
+    @staticmethod
+    def _drain(futures):
+        """After an abort, cancel effects that have not started and wait for the running ones before cleanup."""
+        effects = [f for future in futures if future.done() and not future.cancelled() and future.exception() is None
+                   for f in future.result()]
+        for f in effects:
+            f.cancel()
+        for f in effects:
+            if not f.cancelled():
+                f.exception()
+
+    def render_segment(self, seg):
+        """Apply one segment's effects, writing seg['out']."""
+        effects = dict(seg['effects'])
+        sfx_paths = self.resolve_sfx(effects.pop('sfx_path', None))
+        if self.backend == 'numpy':
+            # the DSP runs in the scheduler's process pool; library SFX are passed as pre-decoded PCM
+            sfx_sources = [self.sfx_source(p) for p in sfx_paths]
+            wall, cpu = self.scheduler.run_in_process(dsp.render_effects_file, self.ffmpeg, seg['raw'], seg['out'],
+                                                      effects, sfx_sources, self.bitrate)
+            self.profiler.add_stage('effects', wall, cpu, os.path.getsize(seg['raw']), os.path.getsize(seg['out']))
+            self.profiler.count('subprocesses')
+        else:
+            self.apply_effects(seg['raw'], seg['out'], sfx_path=sfx_paths, **effects)
+        seg['rendered'] = True
+
+    def render_segments(self, segments, final_out):
+        """Apply effects to segments not rendered yet, then master and join them in original line order.
+
+        Mastering: one batched loudness pass gives every segment its gain to dsp.TARGET_LUFS, and a
+        single limiter runs over the joined story. Narrator segments get their 8D pan here, with the
+        LFO phase carried over from the previous narrator segment; the story's ambient beds loop
+        under the joined result. Writes the timing sidecar (see timing_path) next to final_out.
+        """
+        for seg in segments:
+            if not seg.get('cached') and not seg.get('rendered'):
+                self.render_segment(seg)
+        ordered = sorted(segments, key=lambda s: s['index'])
+        ambient = self.resolve_sfx(list(dict.fromkeys(p for seg in ordered for p in seg.get('ambient', ()))))
+        if self.backend == 'numpy':
+            # segments are lossless PCM, so the story is encoded exactly once
+            buffers = [np.load(seg['out'], mmap_mode='r') if seg['out'].endswith('.npy') else self.decode(seg['out'])
+                       for seg in ordered]
+            lengths = [len(b) for b in buffers]
+            with self.profiler.stage('master'):
+                gains = dsp.master_gains(buffers)
+            for i, pulsator in enumerate(self.pulsators(ordered, lengths)):
+                buffers[i] = buffers[i] * np.float32(gains[i])
+                if pulsator:
+                    buffers[i] = dsp.apulsator(buffers[i], pulsator[0], phase=pulsator[1]) * dsp.PULSATOR_MAKEUP
+            with self.profiler.stage('encode'):
+                samples = np.concatenate(buffers) if buffers else dsp.silence(0.3)
+                if ambient:
+                    dsp.loop_mix(samples, [self._sfx_buffer(p) for p in ambient])
+                self.encode(dsp.limit(samples), final_out)
+                self.profiler.add_bytes(bytes_out=os.path.getsize(final_out))
+        else:
+            lengths, gains = self.segment_gains(ordered)
+            self.concat([seg['out'] for seg in ordered], final_out, self.pulsators(ordered, lengths), ambient, gains)
+        self.write_timing(ordered, lengths, final_out)
+        logger.info("Done! Final audio -> %s", final_out)
+        return final_out
+
+    def segment_gains(self, ordered):
+        """Lengths and mastering gains of rendered segments, from one batched loudness pass (dsp.master_gains)."""
+        buffers = [dsp.load(seg['out']) for seg in ordered]
+        with self.profiler.stage('master'):
+            return [len(b) for b in buffers], dsp.master_gains(buffers)
+
+    @staticmethod
+    def pulsators(ordered, lengths):
+        """(pan rate, LFO phase in cycles) for each segment panned at the join, counting narrator time only."""
+        pulsators, elapsed = [], 0
+        for seg, length in zip(ordered, lengths):
+            rate = seg.get('pulsator')
+            pulsators.append((rate, rate * elapsed / dsp.SAMPLE_RATE) if rate else None)
+            if rate:
+                elapsed += length
+        return pulsators
+
+    @staticmethod
+    def write_timing(ordered, lengths, final_out):
+        """Write each line's start/end (seconds) in final_out to its timing sidecar."""
+        lines, position = [], 0
+        for seg, length in zip(ordered, lengths):
+            lines.append({'index': seg['index'], 'role': seg.get('role'), 'text': seg['text'],
+                          'start': round(position / dsp.SAMPLE_RATE, 3),
+                          'end': round((position + length) / dsp.SAMPLE_RATE, 3)})
+            position += length
+        with open(timing_path(final_out), 'w', encoding='utf-8') as f:
+            json.dump({'duration': round(position / dsp.SAMPLE_RATE, 3), 'lines': lines}, f, indent=2)
+
+    def iter_preview(self, story_text, work_dir="temp_preview", max_lines=4, seed=None):
+        """Quick low-quality clips of a story's first lines, yielded in line order as (segment, path).
+
+        TTS for all of them starts at once; each clip gets only its pan and an RMS gain (see
+        dsp.render_preview) and is encoded to MP3 at the processor's bitrate, so the first one is
+        ready about one TTS round trip after the call.
+        """
+        segments = sorted(self.plan_story(story_text, work_dir, prefix="preview_", seed=seed, ambience=False),
+                          key=lambda s: s['index'])[:max_lines]
+        groups = self._groups(segments)
+        if not groups:
+            return
+        elapsed = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_in_flight, len(groups)))) as pool:
+            futures = [pool.submit(self.synthesize_batch, group) for group in groups]
+            for group, future in zip(groups, futures):
+                future.result()
+                for seg in group:
+                    path = os.path.join(work_dir, f"preview_{seg['index']}.mp3")
+                    with self.profiler.stage('preview'):
+                        samples = np.concatenate([self.decode(seg['raw']), dsp.silence(0.3)])
+                        rate = seg.get('pulsator')
+                        samples = dsp.render_preview(samples, seg['effects'].get('pan_pos'), seg['effects'].get('pan_rate', 0.2),
+                                                     rate, rate * elapsed / dsp.SAMPLE_RATE if rate else 0.0)
+                        if rate:
+                            elapsed += len(samples)
+                        self.encode(np.clip(samples, -1.0, 1.0), path)
+                        self.profiler.add_bytes(bytes_out=os.path.getsize(path))
+                    yield seg, path
+
+    def process_story(self, story_text, work_dir="temp", final_out="output.mp3", seed=None):
+        """Render one story, pipelining each segment's effects behind its TTS request."""
+        # the whole render as one stage, closed before the report is written
+        with self.profiler.stage('process_story'):
+            segments = self.plan_story(story_text, work_dir, seed=seed)
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_in_flight, len(segments)))) as pool:
+                self._wait_segments(self._submit_segments(pool, segments))
+            self.render_segments(segments, final_out)
+            self.cleanup(work_dir)
+        self.write_report(final_out=final_out)
+        return final_out
+
+    def process_chunks(self, chunks, final_outs, work_dir="temp", seed=None, manifest=None):
+        """Process several story chunks, sending all of their TTS requests through one concurrent stage."""
+        return list(self.iter_chunks(chunks, final_outs, work_dir, seed, manifest))
+
+    @profiled('process_story')
+    def iter_chunks(self, chunks, final_outs, work_dir="temp", seed=None, manifest=None, ambience=True):
+        """Render chunks in order, yielding each output path as soon as that chunk is finished.
+
+        TTS for all chunks is submitted up front (first chunk first), and each segment's effects
+        start on the shared scheduler as soon as its audio arrives, so later chunks synthesize and
+        render while earlier ones are being assembled and consumed.
+
+        With a RenderManifest, segments and chunks whose fingerprints match the previous run are
+        reused from its store and only changed lines are synthesized and rendered.
+
+        The 'process_story' stage spans the whole iteration, including the time the caller spends
+        between chunks.
+        """
+        if manifest is not None and seed is None and self.seed is None:
+            # fingerprints include the jitter, so incremental renders need it to be repeatable
+            seed = 0
+        plans = [self.plan_story(chunk, work_dir, prefix=f"chunk{i}_", seed=seed, ambience=ambience)
+                 for i, chunk in enumerate(chunks)]
+        if manifest is not None:
+            for i, segments in enumerate(plans):
+                manifest.attach(segments, self.backend, i, self.tts.name)
+        pool = ThreadPoolExecutor(max_workers=max(1, self.max_in_flight))
+        stop = threading.Event()
+        futures = []
+        try:
+            futures = [self._submit_segments(pool, [seg for seg in segments if not seg.get('cached')], stop)
+                       for segments in plans]
+            for segments, chunk_futures, final_out in zip(plans, futures, final_outs):
+                self._wait_segments(chunk_futures)
+                chunk_path = manifest.chunk_path(segments, os.path.splitext(final_out)[1]) if manifest is not None else None
+                if chunk_path and os.path.exists(chunk_path):
+                    copy_with_timing(chunk_path, final_out)
+                else:
+                    self.render_segments(segments, final_out)
+                    if chunk_path:
+                        copy_with_timing(final_out, chunk_path)
+                yield final_out
+            if manifest is not None:
+                manifest.save()
+        finally:
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+            self._drain([f for chunk_futures in futures for f in chunk_futures])
+            self.cleanup(work_dir)
+
+    def write_report(self, **extra):
+        """Write this processor's stage report to RENDER_REPORT_DIR (if set); returns the report."""
+        if not self.report_dir:
+            return self.profiler.report()
+        path = os.path.join(self.report_dir, f"render-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(self):x}.json")
+        return self.profiler.write_report(path, backend=self.backend, **extra)
+
+    def cleanup(self, work_dir):
+        """Remove the work dir after a render (the SFX library is kept for the next one)."""
         if os.path.exists(work_dir):
             shutil.rmtree(work_dir)
-        if os.path.exists('sfx'):
-            for f in os.listdir('sfx'):
-                try:
-                    os.remove(os.path.join('sfx', f))
-                except Exception as e:
-                    print(f"Could not delete SFX file {f}: {e}")
-        return final_out
 
+    @profiled('sfx_fetch')
     def fetch_sfx_from_freesound(self, query, out_path, api_key=None):
-        """Fetch a free SFX from Freesound.org API and save to out_path. Returns True if successful."""
+        """Fetch a free SFX from Freesound.org API and save to out_path. Returns the sound's metadata (truthy) if successful, else False."""
         api_key = api_key or os.getenv("FREESOUND_API_KEY")
         if not api_key:
-            print("Freesound API key not set. Set FREESOUND_API_KEY in your .env file.")
+            logger.warning("Freesound API key not set. Set FREESOUND_API_KEY in your .env file.")
             return False
-        # Map cue to better search terms
-        cue_map = {
-            'rain': 'rain heavy rainstorm',
-            'forest': 'forest ambience birds',
-            'gate': 'gate creak open metal',
-            'battle': 'battle swords fight',
-            'storm': 'storm thunder',
-            'fire': 'fire crackling',
-            'crowd': 'crowd talking',
-            'wind': 'wind blowing',
-            'river': 'river stream water',
-            'beast': 'beast roar monster',
-        }
-        search_term = cue_map.get(query, query)
-        base_url = "https://freesound.org/apiv2"
+        search_term = FREESOUND_QUERIES.get(query, query)
+        base_url = self.freesound_url
         headers = {"Authorization": f"Token {api_key}"}
-        params = {"query": search_term, "fields": "id,previews,license", "page_size": 1}
+        params = {"query": search_term, "fields": "id,name,previews,license", "page_size": 1}
         try:
-            resp = requests.get(f"{base_url}/search/text/", headers=headers, params=params, timeout=10)
+            resp = self.http.get(f"{base_url}/search/text/", endpoint="freesound_search", headers=headers, params=params, timeout=10)
             resp.raise_for_status()
             results = resp.json().get("results", [])
             if not results:
-                print(f"No SFX found for '{search_term}' on Freesound.")
+                logger.warning("No SFX found for '%s' on Freesound.", search_term)
                 return False
             preview_url = results[0]["previews"]["preview-hq-mp3"]
-            sfx_data = requests.get(preview_url, timeout=10)
+            sfx_data = self.http.get(preview_url, endpoint="freesound_preview", timeout=10)
             sfx_data.raise_for_status()
             # Ensure the output directory exists
             os.makedirs(os.path.dirname(out_path), exist_ok=True)
-            with open(out_path, "wb") as f:
+            # write aside and swap in: other renders may be reading the library
+            tmp = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
                 f.write(sfx_data.content)
-            print(f"Downloaded SFX for '{search_term}' to {out_path}")
-            return True
+            os.replace(tmp, out_path)
+            self.profiler.add_bytes(bytes_out=len(sfx_data.content))
+            logger.info("Downloaded SFX for '%s' to %s", search_term, out_path)
+            return {"source": "freesound", "id": results[0].get("id"), "name": results[0].get("name"),
+                    "license": results[0].get("license")}
         except Exception as e:
-            print(f"Error fetching SFX from Freesound: {e}")
+            logger.error("Error fetching SFX from Freesound: %s", e)
             return False
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""Benchmark the precompiled cue matcher against per-call substring scanning on large manuscripts.
+
+Run from the repo root:  python -m benchmarks.cue_matcher [--max-mb 16]
+Time per MB should stay flat as the manuscript grows (linear scaling).
+"""
+import argparse
+import json
+import random
+import time
+
+from cue_matcher import CueMatcher, default_cue_tables
+
+VOICES = {'narrator': None, 'male_character': None, 'female_character': None}
+WORDS = ("the a of and to in was she he they night sky rift queen stood before gathered houses "
+         "rain forest fired storm whispered shouted door sword people wind river beast bright left "
+         "behind echoing distant calm angry happy sadly crusade brain enjoy").split()
+
+
+def make_manuscript(size_bytes, seed=0):
+    rng = random.Random(seed)
+    lines, size = [], 0
+    while size < size_bytes:
+        line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 20))).capitalize() + '.'
+        if rng.random() < 0.2:
+            line = rng.choice(['Male Character: ', 'Female Character: ']) + line
+        lines.append(line)
+        size += len(line) + 1
+    return lines
+
+
+def substring_scan(line, tables):
+    """The old approach: test every keyword with `in` against the lowercased line."""
+    lower = line.lower()
+    return {kind: [cue for cue, keywords in cues.items() if any(k in lower for k in keywords)]
+            for kind, cues in tables.items()}
+
+
+def bench(lines, fn):
+    start = time.perf_counter()
+    for line in lines:
+        fn(line)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--max-mb', type=float, default=16)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    tables = default_cue_tables(VOICES)
+    matcher = CueMatcher(tables)
+    results = []
+    size_mb = 0.25
+    print(f"{'size MB':>8} {'matcher s':>10} {'s/MB':>8} {'substring s':>12} {'s/MB':>8}")
+    while size_mb <= args.max_mb:
+        lines = make_manuscript(int(size_mb * 1024 * 1024))
+        t_matcher = bench(lines, matcher.classify)
+        t_substring = bench(lines, lambda line: substring_scan(line, tables))
+        results.append({'size_mb': size_mb, 'lines': len(lines),
+                        'matcher_s': t_matcher, 'substring_s': t_substring})
+        print(f"{size_mb:>8.2f} {t_matcher:>10.3f} {t_matcher / size_mb:>8.3f} "
+              f"{t_substring:>12.3f} {t_substring / size_mb:>8.3f}")
+        size_mb *= 2
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
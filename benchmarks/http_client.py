@@ -0,0 +1,156 @@
+"""Check HttpClient / AsyncHttpClient retries against a local server that answers 429/5xx (or too slowly) before 200.
+
+Run from the repo root:  python -m benchmarks.http_client
+Each scenario is a scripted sequence of responses, each sent after its own delay; the client must
+retry the right number of times (including after a read timeout), wait as long as Retry-After asks
+(capped at max_backoff, else full jitter) and record every attempt, slow ones at their full
+duration, in its latency histogram and the profiler. Exits non-zero if any check fails.
+"""
+import asyncio
+import itertools
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from http_client import AsyncHttpClient, HttpClient, httpx
+from instrumentation import Profiler
+
+# name: (responses as (status, Retry-After, seconds before answering), client settings,
+#        expected final status, retries, min/max seconds spent waiting between attempts)
+SCENARIOS = {
+    'retry_after': ([(429, '0.2', 0), (503, '0.3', 0), (200, None, 0)], {'retries': 3}, 200, 2, 0.5, 1.0),
+    'exhausted': ([(503, '0.05', 0)] * 4, {'retries': 3}, 503, 3, 0.15, 0.6),
+    'capped': ([(429, '30', 0), (200, None, 0)], {'retries': 3, 'max_backoff': 0.2}, 200, 1, 0.2, 0.6),
+    'jitter': ([(502, None, 0), (504, None, 0), (200, None, 0)], {'retries': 3, 'backoff': 0.1}, 200, 2, 0.0, 0.4),
+    # the first answer comes after the read timeout: the client gives up on it and retries
+    'timeout': ([(200, None, 1.0), (200, None, 0)], {'retries': 3, 'backoff': 0.1, 'timeout': (1.0, 0.2)},
+                200, 1, 0.0, 0.3),
+    'slow': ([(503, None, 0.3), (200, None, 0.3)], {'retries': 3, 'backoff': 0.1}, 200, 1, 0.0, 0.3),
+}
+
+
+class ScriptedServer:
+    """Local server answering POST /<scenario> with that scenario's responses in turn."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scripts = {}
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def script(self, path, responses):
+        with self._lock:
+            self._scripts[path] = iter(responses)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with server._lock:
+                    status, retry_after, delay = next(server._scripts[self.path], (500, None, 0))
+                time.sleep(delay)
+                body = b'{}'
+                try:
+                    self.send_response(status)
+                    if retry_after:
+                        self.send_header('Retry-After', retry_after)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out and hung up
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def check(kind, name, client, profiler, resp, elapsed):
+    """Compare one run with its scenario; returns the failed checks."""
+    responses, settings, status, retries, min_wait, max_wait = SCENARIOS[name]
+    histogram = client.latency_stats()['stub']
+    # every attempt lasts at least as long as the server waited, or until the read timeout
+    read_timeout = settings.get('timeout', client.timeout)[1]
+    min_latency = sum(min(delay, read_timeout) for _, _, delay in responses[:retries + 1])
+    # time not spent in requests was spent backing off
+    waited = elapsed - histogram['sum']
+    print(f"{kind:>6} {name:>12} {resp.status_code:>7} {client.retry_count:>8} {waited:>9.3f} {histogram['count']:>9}")
+    failures = []
+    for what, got, expected in (
+        ('status', resp.status_code, status),
+        ('retry_count', client.retry_count, retries),
+        ('profiler http_retries', profiler.counters.get('http_retries', 0), retries),
+        ('histogram count', histogram['count'], retries + 1),
+        ('profiler latency count', profiler.report()['http_latency']['stub']['count'], retries + 1),
+    ):
+        if got != expected:
+            failures.append(f"{kind} {name}: {what} {got}, expected {expected}")
+    if not min_wait <= waited <= max_wait:
+        failures.append(f"{kind} {name}: waited {waited:.3f}s, expected {min_wait}-{max_wait}s")
+    if histogram['sum'] < min_latency:
+        failures.append(f"{kind} {name}: histogram sum {histogram['sum']:.3f}s, expected at least {min_latency:.3f}s")
+    return failures
+
+
+def run_sync(server, name, counter):
+    responses, settings, *_ = SCENARIOS[name]
+    path = f'/{name}-{next(counter)}'
+    server.script(path, responses)
+    profiler = Profiler()
+    client = HttpClient(profiler=profiler, **settings)
+    start = time.perf_counter()
+    resp = client.post(server.url + path, endpoint='stub', json={})
+    elapsed = time.perf_counter() - start
+    client.close()
+    return check('sync', name, client, profiler, resp, elapsed)
+
+
+async def run_async(server, name, counter):
+    responses, settings, *_ = SCENARIOS[name]
+    path = f'/{name}-{next(counter)}'
+    server.script(path, responses)
+    profiler = Profiler()
+    client = AsyncHttpClient(profiler=profiler, **settings)
+    start = time.perf_counter()
+    resp = await client.post(server.url + path, endpoint='stub', json={})
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return check('async', name, client, profiler, resp, elapsed)
+
+
+def main():
+    server = ScriptedServer().start()
+    counter = itertools.count()
+    failures = []
+    print(f"{'client':>6} {'scenario':>12} {'status':>7} {'retries':>8} {'waited s':>9} {'requests':>9}")
+    try:
+        for name in SCENARIOS:
+            failures += run_sync(server, name, counter)
+        if httpx is None:
+            print("httpx not installed, skipping AsyncHttpClient")
+        else:
+            for name in SCENARIOS:
+                failures += asyncio.run(run_async(server, name, counter))
+    finally:
+        server.stop()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("All retry checks passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""Benchmark the whole story pipeline offline, against local stubs for Unreal Speech, Freesound and Gemini.
+
+Run from the repo root:  python -m benchmarks.pipeline [--max-kb 64] [--json results.json]
+
+Each (target, story size) runs in a fresh child process so peak RSS is per run. Targets:
+  process_story  AudioProcessor.process_story on the whole story
+  chunks         the main.py path: clean_story (Gemini stub), split_story_into_chunks, process_chunks, concat_files
+  app            POST / on the Flask app (test client)
+The stub TTS returns a WAV tone of about one second per 15 characters, after --tts-latency seconds.
+Throughput is seconds of synthesized audio per second of wall time. Exits non-zero if a target's
+audio does not grow with the story size.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+from benchmarks.cue_matcher import make_manuscript
+
+TARGETS = ('process_story', 'chunks', 'app')
+CHARS_PER_SECOND = 15
+STUB_RATE = 24000
+
+
+def make_story(size_bytes, seed=0):
+    """Synthetic story: cue-rich lines with some character labels, in paragraphs of 8 lines."""
+    lines = make_manuscript(size_bytes, seed)
+    return '\n\n'.join('\n'.join(lines[i:i + 8]) for i in range(0, len(lines), 8))
+
+
+def make_wav(seconds, freq=220.0, noise=False):
+    """Mono 16-bit WAV (stdlib wave container): a tone standing in for speech, or noise for ambience."""
+    n = max(1, int(seconds * STUB_RATE))
+    if noise:
+        samples = np.random.default_rng(0).uniform(-3000, 3000, n)
+    else:
+        samples = 8000 * np.sin(2 * np.pi * freq * np.arange(n) / STUB_RATE)
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(STUB_RATE)
+        w.writeframes(samples.astype('<i2').tobytes())
+    return buf.getvalue()
+
+
+class StubServer:
+    """Threaded local server standing in for the three external APIs, with configurable latency."""
+
+    def __init__(self, tts_latency=0.2, freesound_latency=0.1, gemini_latency=0.5):
+        self.tts_latency = tts_latency
+        self.freesound_latency = freesound_latency
+        self.gemini_latency = gemini_latency
+        self.stats = {'tts_requests': 0, 'audio_s': 0.0, 'freesound_requests': 0, 'gemini_requests': 0}
+        self._lock = threading.Lock()
+        self._tone = {}
+        self._noise = make_wav(5.0, noise=True)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def _tone_for(self, seconds):
+        # generated audio is cached per 0.1 s so the stub itself stays cheap
+        key = round(seconds, 1)
+        if key not in self._tone:
+            self._tone[key] = make_wav(key)
+        return self._tone[key]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                path = urlparse(self.path).path
+                if path == '/stream':
+                    seconds = max(0.5, len(payload.get('Text', '')) / CHARS_PER_SECOND)
+                    with stub._lock:
+                        stub.stats['tts_requests'] += 1
+                        stub.stats['audio_s'] += seconds
+                        body = stub._tone_for(seconds)
+                    time.sleep(stub.tts_latency)
+                    self._send(body, 'audio/wav')
+                elif path == '/gemini':
+                    with stub._lock:
+                        stub.stats['gemini_requests'] += 1
+                    prompt = payload['contents'][0]['parts'][0]['text']
+                    # "cleaned" like a model returning plain prose: same text, whitespace normalized.
+                    # An echo would make clean_story fall back to local cleaning, which truncates.
+                    story = ' '.join(prompt.split('\n\n', 1)[1].split())
+                    time.sleep(stub.gemini_latency)
+                    body = {'candidates': [{'content': {'parts': [{'text': story}]}}]}
+                    self._send(json.dumps(body).encode('utf-8'), 'application/json')
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                with stub._lock:
+                    stub.stats['freesound_requests'] += 1
+                time.sleep(stub.freesound_latency)
+                if path == '/search/text/':
+                    previews = {'preview-hq-mp3': f'{stub.url}/preview.wav'}
+                    body = {'results': [{'id': 1, 'name': 'stub', 'license': 'CC0', 'previews': previews}]}
+                    self._send(json.dumps(body).encode('utf-8'), 'application/json')
+                elif path == '/preview.wav':
+                    self._send(stub._noise, 'audio/wav')
+                else:
+                    self.send_error(404)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def _peak_rss_mb(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_one(target, size_bytes, seed):
+    """Child process: render one synthetic story and return wall time, peak RSS and stage metrics."""
+    from instrumentation import METRICS
+    story = make_story(size_bytes, seed)
+    work_dir = tempfile.mkdtemp(prefix='audio5d_bench_')
+    METRICS.reset()
+    start = time.perf_counter()
+    if target == 'process_story':
+        from audio_processor import AudioProcessor
+        proc = AudioProcessor(ffmpeg_bin=os.environ['FFMPEG_BIN'])
+        out = proc.process_story(story, os.path.join(work_dir, 'segments'), os.path.join(work_dir, 'story' + proc.output_ext))
+    elif target == 'chunks':
+        from audio_processor import AudioProcessor
+        from main import clean_story, split_story_into_chunks
+        proc = AudioProcessor(ffmpeg_bin=os.environ['FFMPEG_BIN'])
+        cleaned = clean_story(story, http=proc.http, profiler=proc.profiler)
+        with proc.profiler.stage('split'):
+            chunks = split_story_into_chunks(cleaned, max_chunk_length=950)
+        chunk_outs = [os.path.join(work_dir, f'chunk_{i}.wav') for i in range(len(chunks))]
+        proc.process_chunks(chunks, chunk_outs, os.path.join(work_dir, 'segments'))
+        out = proc.concat_files(chunk_outs, os.path.join(work_dir, 'story' + proc.output_ext))
+    else:
+        import app
+        # a result-cache hit answers 303 to /results/...; follow it so that case is timed too
+        resp = app.app.test_client().post('/', data={'story_text': story}, follow_redirects=True)
+        if resp.status_code != 200:
+            raise RuntimeError(f"POST / returned {resp.status_code}")
+        out = None
+    wall = time.perf_counter() - start
+    output_bytes = os.path.getsize(out) if out else None
+    shutil.rmtree(work_dir, ignore_errors=True)
+    report = METRICS.report()
+    return {
+        'wall_s': wall,
+        'output_bytes': output_bytes,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF if resource else None),
+        'peak_child_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN if resource else None),
+        'subprocesses': report['counters'].get('subprocesses', 0),
+        'counters': report['counters'],
+        'stages': {name: {k: stats[k] for k in ('count', 'wall_s', 'cpu_s', 'wall_p50_s', 'wall_p95_s', 'wall_p99_s')}
+                   for name, stats in report['stages'].items()},
+    }
+
+
+def run_case(stub, target, size_kb, seed, env, verbose=False):
+    before = stub.snapshot()
+    proc = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.pipeline', '--child', target, str(size_kb), '--seed', str(seed)],
+        env=env, check=True, stdout=subprocess.PIPE, stderr=None if verbose else subprocess.DEVNULL, text=True,
+    )
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    after = stub.snapshot()
+    served = {k: after[k] - before[k] for k in after}
+    result.update(target=target, size_kb=size_kb, tts_requests=served['tts_requests'],
+                  audio_s=served['audio_s'], throughput=served['audio_s'] / result['wall_s'])
+    return result
+
+
+def check_scaling(results, tolerance=0.75):
+    """Failures where a target's audio does not grow with the story (e.g. the text got truncated)."""
+    failures = []
+    for target in dict.fromkeys(r['target'] for r in results):
+        runs = sorted((r for r in results if r['target'] == target), key=lambda r: r['size_kb'])
+        for small, big in zip(runs, runs[1:]):
+            expected = small['audio_s'] * big['size_kb'] / small['size_kb']
+            if big['audio_s'] < tolerance * expected:
+                failures.append(f"{target}: {big['size_kb']:g} KB gave {big['audio_s']:.1f} s of audio, "
+                                f"expected about {expected:.1f} s from {small['size_kb']:g} KB")
+    return failures
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['target'], r['size_kb']): r for r in json.load(f)['results']}
+    print(f"\n{'target':<14} {'KB':>6} {'throughput':>11} {'baseline':>9} {'change':>8}")
+    for r in results:
+        old = baseline.get((r['target'], r['size_kb']))
+        if old:
+            change = (r['throughput'] / old['throughput'] - 1) * 100 if old['throughput'] else 0.0
+            print(f"{r['target']:<14} {r['size_kb']:>6g} {r['throughput']:>10.2f}x {old['throughput']:>8.2f}x {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default=','.join(TARGETS), help='comma-separated subset of ' + ', '.join(TARGETS))
+    parser.add_argument('--min-kb', type=float, default=1)
+    parser.add_argument('--max-kb', type=float, default=64, help='story sizes double from --min-kb up to this (1024 = 1 MB)')
+    parser.add_argument('--tts-latency', type=float, default=0.2)
+    parser.add_argument('--freesound-latency', type=float, default=0.1)
+    parser.add_argument('--gemini-latency', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='print throughput change against a previous --json file')
+    parser.add_argument('--verbose', action='store_true', help="show the children's logs and ffmpeg output")
+    parser.add_argument('--child', nargs=2, metavar=('TARGET', 'SIZE_KB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        target, size_kb = args.child
+        print(json.dumps(run_one(target, int(float(size_kb) * 1024), args.seed)))
+        return
+
+    stub = StubServer(args.tts_latency, args.freesound_latency, args.gemini_latency).start()
+    work_root = tempfile.mkdtemp(prefix='audio5d_bench_')
+    env = dict(
+        os.environ,
+        FFMPEG_BIN=os.getenv('FFMPEG_BIN', 'ffmpeg'),
+        UNREAL_SPEECH_URL=f'{stub.url}/stream', UNREAL_SPEECH_API_KEY='bench',
+        FREESOUND_URL=stub.url, FREESOUND_API_KEY='bench',
+        GEMINI_URL=f'{stub.url}/gemini', GEMINI_API_KEY='bench',
+        # every run starts cold: no TTS or result cache, empty SFX library, no reports
+        TTS_CACHE_DIR='', RESULT_CACHE_DIR='', SFX_LIBRARY_DIR=os.path.join(work_root, 'sfx'), SFX_OFFLINE='0', RENDER_REPORT_DIR='',
+        LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'),
+    )
+    targets = [t for t in args.targets.split(',') if t]
+    results = []
+    print(f"{'target':<14} {'KB':>6} {'wall s':>8} {'audio s':>8} {'thruput':>8} {'RSS MB':>7} {'procs':>6} {'tts p95':>8} {'fx p95':>7}")
+    size_kb = args.min_kb
+    try:
+        while size_kb <= args.max_kb:
+            for target in targets:
+                r = run_case(stub, target, size_kb, args.seed, env, args.verbose)
+                results.append(r)
+                tts = r['stages'].get('tts', {}).get('wall_p95_s', 0.0)
+                fx = r['stages'].get('effects', {}).get('wall_p95_s', 0.0)
+                print(f"{target:<14} {size_kb:>6g} {r['wall_s']:>8.2f} {r['audio_s']:>8.1f} {r['throughput']:>7.2f}x "
+                      f"{r['peak_rss_mb'] or 0:>7.0f} {r['subprocesses']:>6} {tts:>8.3f} {fx:>7.3f}")
+            size_kb *= 2
+    finally:
+        stub.stop()
+        shutil.rmtree(work_root, ignore_errors=True)
+    meta = {
+        'python': platform.python_version(), 'platform': platform.platform(), 'cores': os.cpu_count(),
+        'backend': os.getenv('AUDIO_BACKEND', 'ffmpeg'), 'codec': os.getenv('OUTPUT_CODEC', 'mp3'),
+        'tts_latency': args.tts_latency, 'freesound_latency': args.freesound_latency,
+        'gemini_latency': args.gemini_latency, 'seed': args.seed, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if args.compare:
+        compare(results, args.compare)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+    failures = check_scaling(results)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import re
+from collections import namedtuple
+
+CueMatch = namedtuple('CueMatch', 'kind cue keyword start end')
+
+# Emotion cues in priority order → TTS (speed, pitch, volume)
+EMOTION_CUES = {
+    'shout': ['shout', 'shouts', 'shouting', 'shouted', 'yell', 'yelled', 'yelling', 'exclaimed', 'loudly', '!'],
+    'whisper': ['whisper', 'whispers', 'whispering', 'whispered', 'softly', 'murmur', 'murmured', 'quietly'],
+    'sad': ['sad', 'sadly', 'sorrow', 'cry', 'cries', 'crying', 'cried'],
+    'happy': ['happy', 'happily', 'joy', 'joyful', 'excited', 'excitedly'],
+    'angry': ['angry', 'angrily', 'furious', 'rage', 'raged'],
+    'calm': ['calm', 'calmly', 'serene', 'peaceful'],
+}
+EMOTION_PARAMS = {
+    'shout': ('0.25', '1.25', '1.3'),
+    'whisper': ('-0.25', '0.9', '0.7'),
+    'sad': ('-0.15', '0.8', '0.9'),
+    'happy': ('0.12', '1.12', '1.1'),
+    'angry': ('0.18', '1.18', '1.2'),
+    'calm': ('-0.12', '1.0', '0.9'),
+}
+
+SFX_CUES = {
+    'rain': ['rain', 'rains', 'raining', 'rained', 'poured', 'pouring', 'downpour'],
+    'forest': ['forest', 'forests', 'woods', 'trees'],
+    'gate': ['gate', 'gates', 'door', 'doors', 'creaked', 'opened'],
+    'battle': ['battle', 'fight', 'fighting', 'fought', 'sword', 'swords', 'combat'],
+    'storm': ['storm', 'storms', 'stormy', 'thunder', 'thundered', 'lightning', 'tempest', 'rumbled'],
+    'fire': ['fire', 'fires', 'flame', 'flames', 'burn', 'burning', 'burned', 'burnt', 'crackled'],
+    'crowd': ['crowd', 'crowds', 'chanting', 'people', 'voices'],
+    'wind': ['wind', 'winds', 'windy', 'howled', 'gust', 'gusts'],
+    'river': ['river', 'rivers', 'stream', 'streams', 'water', 'rushing'],
+    'beast': ['beast', 'beasts', 'roar', 'roared', 'monster', 'monsters', 'growl', 'growled', 'growling'],
+}
+
+# Ambience that should persist for the whole story or scene
+AMBIENT_CUES = {
+    'rain': ['rain', 'rains', 'raining', 'rained'],
+    'forest': ['forest', 'forests'],
+    'wind': ['wind', 'winds', 'windy'],
+    'river': ['river', 'rivers'],
+    'storm': ['storm', 'storms', 'stormy'],
+    'crowd': ['crowd', 'crowds'],
+    'fire': ['fire', 'fires'],
+}
+
+# Pan cues in priority order → pan position
+PAN_CUES = {
+    'left': ['left'],
+    'right': ['right'],
+    'behind': ['behind'],
+}
+PAN_POSITIONS = {'left': -1.0, 'right': 1.0, 'behind': 0.0}
+
+REVERB_CUES = {
+    'distant': ['behind', 'echo', 'echoes', 'echoed', 'echoing', 'distant', 'far away'],
+}
+
+
+def role_cues(voices):
+    """Role keywords from a voices map: 'male_character' matches 'male_character' and 'male character'."""
+    return {role: sorted({role, role.replace('_', ' ')}) for role in voices}
+
+
+def default_cue_tables(voices):
+    return {
+        'role': role_cues(voices),
+        'emotion': EMOTION_CUES,
+        'sfx': SFX_CUES,
+        'ambient': AMBIENT_CUES,
+        'pan': PAN_CUES,
+        'reverb': REVERB_CUES,
+    }
+
+
+class CueMatcher:
+    """All cue tables compiled into one lookup, so a line is scanned once for every cue class.
+
+    The text is tokenized in a single regex pass and each token is looked up in a keyword table, so cost
+    is linear in the text length however many keywords there are. Keywords only match whole words
+    ('fire' does not match 'fired'); multi-word keywords ('far away') and punctuation keywords ('!') are
+    supported.
+    """
+
+    _TOKEN = re.compile(r"\w+|[^\w\s]")
+
+    def __init__(self, tables):
+        self.tables = tables
+        self._single = {}
+        self._phrases = {}
+        for kind, cues in tables.items():
+            for cue, keywords in cues.items():
+                for keyword in keywords:
+                    tokens = self._TOKEN.findall(keyword.lower())
+                    if len(tokens) == 1:
+                        self._single.setdefault(tokens[0], []).append((kind, cue))
+                    elif tokens:
+                        self._phrases.setdefault(tokens[0], {}).setdefault(tuple(tokens[1:]), []).append((kind, cue))
+        self._max_tail = max((len(tail) for tails in self._phrases.values() for tail in tails), default=0)
+
+    def scan(self, text):
+        """Every cue match in text order, with positions."""
+        matches = []
+        single, phrases = self._single, self._phrases
+        tokens = list(self._TOKEN.finditer(text.lower()))
+        words = [t.group() for t in tokens]
+        for i, word in enumerate(words):
+            targets = single.get(word)
+            if targets:
+                t = tokens[i]
+                matches.extend(CueMatch(kind, cue, word, t.start(), t.end()) for kind, cue in targets)
+            tails = phrases.get(word)
+            if tails:
+                for n in range(1, min(self._max_tail, len(words) - i - 1) + 1):
+                    targets = tails.get(tuple(words[i + 1:i + 1 + n]))
+                    if targets:
+                        start, end = tokens[i].start(), tokens[i + n].end()
+                        keyword = text[start:end].lower()
+                        matches.extend(CueMatch(kind, cue, keyword, start, end) for kind, cue in targets)
+        return matches
+
+    def classify(self, text):
+        """Matched cue names per class, in each table's priority order, plus the raw matches."""
+        matches = self.scan(text)
+        found = {kind: set() for kind in self.tables}
+        for match in matches:
+            found[match.kind].add(match.cue)
+        cues = {kind: [cue for cue in self.tables[kind] if cue in found[kind]] for kind in self.tables}
+        cues['matches'] = matches
+        return cues
@@ -0,0 +1,313 @@
+import os
+import subprocess
+import time
+import numpy as np
+from scipy import ndimage, signal
+from scipy.io import wavfile
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+# final delivery codecs: name -> (file extension, ffmpeg encoder, MIME type).
+# Intermediates between stages are float32 WAV, so only the final file is lossy-encoded.
+CODECS = {
+    'mp3': ('.mp3', 'libmp3lame', 'audio/mpeg'),
+    'opus': ('.opus', 'libopus', 'audio/ogg'),
+    'aac': ('.m4a', 'aac', 'audio/mp4'),
+}
+INTERMEDIATE_EXT = '.wav'
+# apulsator's mean power gain is 3/8; narration pulsated after loudness normalization is made up by this
+PULSATOR_MAKEUP = 0.375 ** -0.5
+# SFX/ambience-to-voice ratio of the original amix (sfx_gain / voice_gain)
+AMBIENCE_GAIN = 0.02 / 3.0
+# mastering: every segment is brought to TARGET_LUFS (ffmpeg loudnorm's default), the story limited to PEAK_CEILING_DB
+TARGET_LUFS = -24.0
+PEAK_CEILING_DB = -2.0
+LIMITER_WINDOW = 0.02
+
+
+def codec_args(out_path, bitrate='256k'):
+    """ffmpeg output codec arguments for out_path, chosen by its extension."""
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext == INTERMEDIATE_EXT:
+        return ['-codec:a', 'pcm_f32le', '-ar', str(SAMPLE_RATE)]
+    for codec_ext, encoder, _ in CODECS.values():
+        if ext == codec_ext:
+            return ['-codec:a', encoder, '-b:a', bitrate]
+    raise ValueError(f"Unsupported output format: {out_path}")
+
+
+def mime_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    return next((mime for codec_ext, _, mime in CODECS.values() if codec_ext == ext), 'audio/wav')
+
+
+def decode(ffmpeg, path, sample_rate=SAMPLE_RATE, run=subprocess.run):
+    """Decode any audio file once to a float32 (n, 2) buffer via a single ffmpeg pipe.
+
+    Our own float32 WAV intermediates are read directly, without a subprocess.
+    """
+    if path.lower().endswith(INTERMEDIATE_EXT):
+        rate, data = wavfile.read(path)
+        if rate == sample_rate and data.dtype == np.float32 and data.ndim == 2 and data.shape[1] == CHANNELS:
+            return data
+    cmd = [ffmpeg, '-nostdin', '-v', 'error', '-i', path,
+           '-f', 'f32le', '-ac', str(CHANNELS), '-ar', str(sample_rate), 'pipe:1']
+    raw = run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    return np.frombuffer(raw, dtype=np.float32).reshape(-1, CHANNELS).copy()
+
+
+def encode(ffmpeg, samples, out_path, bitrate='256k', sample_rate=SAMPLE_RATE, run=subprocess.run):
+    """Encode a float32 (n, 2) buffer in one ffmpeg call; the codec follows out_path's extension.
+
+    WAV intermediates are written directly as float32, without a subprocess.
+    """
+    if out_path.lower().endswith(INTERMEDIATE_EXT):
+        wavfile.write(out_path, sample_rate, np.ascontiguousarray(samples, dtype=np.float32))
+        return
+    cmd = [ffmpeg, '-v', 'error', '-y',
+           '-f', 'f32le', '-ac', str(CHANNELS), '-ar', str(sample_rate), '-i', 'pipe:0',
+           *codec_args(out_path, bitrate), out_path]
+    data = np.ascontiguousarray(samples, dtype=np.float32).tobytes()
+    run(cmd, check=True, input=data)
+
+
+def open_encoder(ffmpeg, out_path, bitrate='256k', sample_rate=SAMPLE_RATE, pipe=False):
+    """Start one ffmpeg process that encodes float32 (n, 2) blocks written to its stdin, for streaming output.
+
+    With pipe=True the encoded stream (in out_path's format, no Xing/Info header) is read from its
+    stdout instead of being written to out_path.
+    """
+    cmd = [ffmpeg, '-v', 'error', '-y',
+           '-f', 'f32le', '-ac', str(CHANNELS), '-ar', str(sample_rate), '-i', 'pipe:0',
+           *codec_args(out_path, bitrate)]
+    if pipe:
+        cmd += ['-write_xing', '0', '-f', os.path.splitext(out_path)[1][1:], 'pipe:1']
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return subprocess.Popen(cmd + [out_path], stdin=subprocess.PIPE)
+
+
+def load(path):
+    """A float32 WAV intermediate or .npy buffer, memory-mapped rather than read."""
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    return wavfile.read(path, mmap=True)[1]
+
+
+def pcm_input_args(path):
+    """ffmpeg input arguments for path. Float32 (n, 2) .npy PCM is read raw past its header, without decoding."""
+    if path.endswith('.npy'):
+        header = np.load(path, mmap_mode='r').offset
+        return ['-f', 'f32le', '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE),
+                '-skip_initial_bytes', str(header), '-i', path]
+    return ['-i', path]
+
+
+def silence(seconds, sample_rate=SAMPLE_RATE):
+    return np.zeros((int(round(seconds * sample_rate)), CHANNELS), dtype=np.float32)
+
+
+def pan(samples, pan_pos):
+    """Static pan, same gains as `pan=stereo|c0=<L>*c0|c1=<R>*c1`."""
+    gains = np.array([max(0.0, 1.0 - pan_pos), max(0.0, 1.0 + pan_pos)], dtype=np.float32)
+    return samples * gains
+
+
+def apulsator(samples, hz, sample_rate=SAMPLE_RATE, amount=1.0, offset_l=0.0, offset_r=0.5, phase=0.0):
+    """Oscillating stereo pan, equivalent to ffmpeg `apulsator=hz=<hz>` with its default sine LFO.
+
+    `phase` (in LFO cycles) lets consecutive segments continue the same motion.
+    """
+    t = phase + np.arange(len(samples), dtype=np.float64) * (hz / sample_rate)
+    lfo_l = np.sin(2 * np.pi * ((t + offset_l) % 1.0)) * amount
+    lfo_r = np.sin(2 * np.pi * ((t + offset_r) % 1.0)) * amount
+    gains = np.stack([lfo_l * 0.5 + amount / 2, lfo_r * 0.5 + amount / 2], axis=1)
+    return (samples * gains).astype(np.float32)
+
+
+def aecho(samples, in_gain, out_gain, delays, decays, sample_rate=SAMPLE_RATE):
+    """Reverb, equivalent to ffmpeg `aecho=<in_gain>:<out_gain>:<delays>:<decays>` (delays in ms, '|'-separated)."""
+    delays = [float(d) for d in str(delays).split('|')]
+    decays = [float(d) for d in str(decays).split('|')]
+    offsets = [int(d * sample_rate / 1000) for d in delays]
+    out = np.zeros((len(samples) + max(offsets), samples.shape[1]), dtype=np.float32)
+    out[:len(samples)] += samples * in_gain
+    for offset, decay in zip(offsets, decays):
+        out[offset:offset + len(samples)] += samples * decay
+    return out * out_gain
+
+
+def _k_weighting(sample_rate):
+    """BS.1770 K-weighting as two biquads (high shelf + high pass)."""
+    # Pre-filter (high shelf, +4 dB above ~1.5 kHz)
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / sample_rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    # RLB high pass (~38 Hz)
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    hp_b = [1.0, -2.0, 1.0]
+    hp_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return (shelf_b, shelf_a), (hp_b, hp_a)
+
+
+def _gated_loudness(block_power):
+    """BS.1770 gating (-70 LUFS absolute, -10 LU relative) of 400 ms block powers."""
+    loud = -0.691 + 10 * np.log10(np.maximum(block_power, 1e-12))
+    gated = block_power[loud > -70.0]
+    if not len(gated):
+        return -70.0
+    relative = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = block_power[(loud > -70.0) & (loud > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def segment_loudness(buffers, sample_rate=SAMPLE_RATE):
+    """Gated integrated loudness in LUFS of each buffer (BS.1770, 400 ms blocks, 75% overlap).
+
+    All buffers are measured in one pass: they are K-weighted as one joined signal and every block
+    power comes from a single cumulative sum; only the gating is per buffer. Buffers shorter than
+    one block read -70.
+    """
+    lengths = [len(b) for b in buffers]
+    block, step = int(0.4 * sample_rate), int(0.1 * sample_rate)
+    if not any(n >= block for n in lengths):
+        return [-70.0] * len(buffers)
+    # both K-weighting biquads as one second-order-sections cascade
+    sos = np.array([[*b, *a] for b, a in _k_weighting(sample_rate)])
+    weighted = signal.sosfilt(sos, np.concatenate(buffers), axis=0)
+    power = np.zeros(len(weighted) + 1)
+    np.cumsum(np.einsum('ij,ij->i', weighted, weighted), out=power[1:])
+    loudness, offset = [], 0
+    for n in lengths:
+        starts = offset + np.arange(0, n - block + 1, step)
+        offset += n
+        loudness.append(_gated_loudness((power[starts + block] - power[starts]) / block) if len(starts) else -70.0)
+    return loudness
+
+
+def integrated_loudness(samples, sample_rate=SAMPLE_RATE):
+    """Gated integrated loudness in LUFS (BS.1770, 400 ms blocks, 75% overlap)."""
+    return segment_loudness([samples], sample_rate)[0]
+
+
+def master_gains(buffers, target_lufs=TARGET_LUFS, sample_rate=SAMPLE_RATE):
+    """Linear gain per buffer that brings it to target_lufs, from one segment_loudness pass.
+
+    Buffers too short or quiet to measure get the median gain of the others.
+    """
+    gains = [10 ** ((target_lufs - lufs) / 20) if lufs > -70.0 else None
+             for lufs in segment_loudness(buffers, sample_rate)]
+    measured = [g for g in gains if g is not None]
+    fallback = float(np.median(measured)) if measured else 1.0
+    return [fallback if g is None else g for g in gains]
+
+
+def limit(samples, ceiling_db=PEAK_CEILING_DB, window=LIMITER_WINDOW, sample_rate=SAMPLE_RATE):
+    """Look-ahead peak limiter: no sample exceeds ceiling_db, with gain changes spread over `window` seconds.
+
+    The gain each sample needs is min-filtered over two windows and then averaged over one, so it
+    ramps down ahead of a peak and back up after it, never above what any sample needs.
+    """
+    ceiling = 10 ** (ceiling_db / 20)
+    peak = np.abs(samples).max(axis=1) if len(samples) else np.zeros(0, dtype=np.float32)
+    if not len(peak) or peak.max() <= ceiling:
+        return samples
+    width = max(1, int(window * sample_rate))
+    needed = np.minimum(1.0, ceiling / np.maximum(peak, 1e-12))
+    gain = ndimage.uniform_filter1d(ndimage.minimum_filter1d(needed, 2 * width + 1), width)
+    # the average of a float32 filter can land a hair above the minimum it covers
+    gain = np.minimum(gain, needed)
+    return (samples * gain[:, None]).astype(np.float32)
+
+
+def amix(voice, sfx_buffers, sfx_gain=AMBIENCE_GAIN):
+    """Mix SFX under the voice, like `amix=inputs=N:duration=first:normalize=0` (output length of the voice)."""
+    out = np.array(voice, dtype=np.float32)
+    for sfx in sfx_buffers:
+        n = min(len(sfx), len(voice))
+        out[:n] += sfx[:n] * sfx_gain
+    return out
+
+
+def loop_mix(out, beds, gain=AMBIENCE_GAIN, offset=0):
+    """Lay looping ambient beds under `out` in place; out[0] sits `offset` samples into the timeline.
+
+    Beds are read one slice per loop, so memory-mapped library PCM is never copied whole.
+    """
+    for bed in beds:
+        if not len(bed):
+            continue
+        pos = 0
+        while pos < len(out):
+            start = (offset + pos) % len(bed)
+            n = min(len(bed) - start, len(out) - pos)
+            out[pos:pos + n] += bed[start:start + n] * gain
+            pos += n
+    return out
+
+
+def render_effects(samples, pan_rate=0.2,
+                   reverb_in_gain=0.8, reverb_out_gain=0.9,
+                   reverb_delays="60|60", reverb_decays="0.4|0.3",
+                   pan_pos=0.0, sfx_buffers=None, sample_rate=SAMPLE_RATE):
+    """In-memory equivalent of the ffmpeg chain in AudioProcessor.apply_effects (pan_pos=None: no panning).
+
+    The result is neither normalized nor clipped: levels are set by the mastering pass at the join
+    (master_gains, limit), and float intermediates keep the headroom until then.
+    """
+    if pan_pos is None:
+        out = samples
+    elif pan_pos != 0.0:
+        out = pan(samples, pan_pos)
+    else:
+        out = apulsator(samples, pan_rate, sample_rate)
+    out = aecho(out, reverb_in_gain, reverb_out_gain, reverb_delays, reverb_decays, sample_rate)
+    if sfx_buffers:
+        out = amix(out, sfx_buffers)
+    return out
+
+
+def render_preview(samples, pan_pos=0.0, pan_rate=0.2, pulsator=None, phase=0.0,
+                   target_db=TARGET_LUFS, true_peak_db=PEAK_CEILING_DB, sample_rate=SAMPLE_RATE):
+    """Cheap stand-in for render_effects in live previews: panning and an RMS gain only.
+
+    No reverb, loudness measurement or SFX. Narration (`pulsator` = pan rate) gets its 8D pan from
+    `phase` on, like at the join; the RMS gain lands near the full render's loudness target.
+    """
+    if pulsator:
+        out = apulsator(samples, pulsator, sample_rate, phase=phase) * PULSATOR_MAKEUP
+    elif pan_pos is None:
+        out = samples
+    elif pan_pos != 0.0:
+        out = pan(samples, pan_pos)
+    else:
+        out = apulsator(samples, pan_rate, sample_rate)
+    rms = float(np.sqrt(np.mean(np.square(out, dtype=np.float64)))) if len(out) else 0.0
+    if rms > 0:
+        gain = 10 ** (target_db / 20) / rms
+        peak = float(np.abs(out).max())
+        out = out * min(gain, 10 ** (true_peak_db / 20) / peak)
+    return out.astype(np.float32)
+
+
+def render_effects_file(ffmpeg, in_path, out_path, effects, sfx_paths=(), bitrate='256k'):
+    """Decode in_path, append the 0.3 s pacing pause, run render_effects and write out_path.
+
+    Module-level so it can run in a worker process. SFX come as pre-decoded .npy PCM (memory-mapped,
+    so the page cache is shared by every worker) or audio files; out_path may be .npy. Returns (wall seconds, CPU seconds) spent in this process.
+    """
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    voice = np.concatenate([decode(ffmpeg, in_path), silence(0.3)])
+    sfx_buffers = [np.load(p, mmap_mode='r') if p.endswith('.npy') else decode(ffmpeg, p) for p in sfx_paths]
+    out = render_effects(voice, sfx_buffers=sfx_buffers, **effects)
+    if out_path.endswith('.npy'):
+        np.save(out_path, out)
+    else:
+        encode(ffmpeg, out, out_path, bitrate)
+    return time.perf_counter() - wall0, time.process_time() - cpu0
@@ -0,0 +1,154 @@
+import multiprocessing
+import multiprocessing.util
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def available_cores():
+    """CPUs this process may run on (honours affinity / container CPU sets where the OS exposes them)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def try_lock_file(path):
+    """fd holding an exclusive lock on path (created if missing), or None if another holder has it.
+
+    Closing the fd drops the lock, as does the holder's process exiting.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class HostSlots:
+    """Counting semaphore shared by every process on the host: one lock file per slot in `directory`.
+
+    A slot is held by locking its file, so the web app, job workers, effects workers and the ASGI
+    server all draw from the same cap, and the OS releases the slots of a process that dies. Use it
+    as a context manager, or acquire()/release() a handle; acquire(blocking=False) never waits.
+    Pickles as its settings, so workers get the same slots.
+    """
+
+    def __init__(self, size, directory, poll=0.01):
+        self.size = size
+        self.directory = directory
+        self.poll = poll
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        return {'size': self.size, 'directory': self.directory, 'poll': self.poll}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def acquire(self, blocking=True):
+        """Take a free slot and return its handle for release(); None if not blocking and all are taken."""
+        while True:
+            # start at a random slot so waiters don't all contend for the first file
+            first = random.randrange(self.size)
+            for i in range(self.size):
+                handle = try_lock_file(os.path.join(self.directory, f'slot-{(first + i) % self.size}.lock'))
+                if handle is not None:
+                    return handle
+            if not blocking:
+                return None
+            time.sleep(self.poll)
+
+    def release(self, handle):
+        # closing the file drops its lock
+        os.close(handle)
+
+    def __enter__(self):
+        self._local.__dict__.setdefault('held', []).append(self.acquire())
+        return self
+
+    def __exit__(self, *exc):
+        self.release(self._local.held.pop())
+
+
+def _run_in_slot(slots, fn, *args):
+    """Process pool entry point: fn(*args) while holding one of the host's ffmpeg slots."""
+    with slots:
+        return fn(*args)
+
+
+def process_context():
+    """multiprocessing context for worker pools: workers start from a clean server process (or are
+    spawned), so they never inherit the parent's open pipes, e.g. a streaming encoder's stdin."""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+class EffectsScheduler:
+    """Core-sized pools for the effects stage, shared by every render in the process.
+
+    submit() queues a segment's effects on a thread pool with one worker per core. The ffmpeg
+    backend runs its filter chain from that thread; the numpy backend hands the DSP to a process
+    pool of the same size with run_in_process(), so the GIL never serializes segments.
+    ffmpeg_slots (HostSlots in slots_dir) caps how many ffmpeg processes run at once across every
+    render in every process on the host; pool workers take a slot only while their job runs.
+    """
+
+    def __init__(self, workers=None, max_ffmpeg=None, slots_dir=None):
+        self.workers = workers or available_cores()
+        self.ffmpeg_slots = HostSlots(max_ffmpeg or self.workers,
+                                      slots_dir or os.path.join(tempfile.gettempdir(), 'audio5d_ffmpeg_slots'))
+        self._threads = None
+        self._processes = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='effects')
+        return self._threads.submit(fn, *args, **kwargs)
+
+    def submit_process(self, fn, *args):
+        """Queue fn(*args) on the process pool and return its future; the worker holds an ffmpeg slot while it runs."""
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context())
+                # inside a job worker process, children are joined before atexit hooks run,
+                # so stop the pool from a finalizer that runs before its queues are closed (priority 10)
+                multiprocessing.util.Finalize(self, self.shutdown, exitpriority=20)
+            return self._processes.submit(_run_in_slot, self.ffmpeg_slots, fn, *args)
+
+    def run_in_process(self, fn, *args):
+        """Run fn(*args) in the process pool and wait for it (workers decode with ffmpeg, so it takes a slot there)."""
+        return self.submit_process(fn, *args).result()
+
+    def shutdown(self):
+        with self._lock:
+            for pool in (self._threads, self._processes):
+                if pool is not None:
+                    pool.shutdown(wait=True, cancel_futures=True)
+            self._threads = self._processes = None
+
+
+# shared by every AudioProcessor in the process (EFFECTS_WORKERS, FFMPEG_MAX_PROCS default to the core count);
+# the ffmpeg cap is shared by every process using the same FFMPEG_SLOTS_DIR
+SCHEDULER = EffectsScheduler(
+    workers=int(os.getenv("EFFECTS_WORKERS", "0")) or None,
+    max_ffmpeg=int(os.getenv("FFMPEG_MAX_PROCS", "0")) or None,
+    slots_dir=os.getenv("FFMPEG_SLOTS_DIR") or None,
+)
@@ -0,0 +1,184 @@
+import asyncio
+import copy
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # only needed by the async serving path (asgi.py)
+    httpx = None
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram (seconds) with Prometheus-style buckets."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'sum': self.total,
+                'buckets': {('+Inf' if b == float('inf') else str(b)): c for b, c in zip(self.buckets, self.counts)},
+            }
+
+
+class HttpClient:
+    """Shared keep-alive HTTP client for TTS, Freesound and Gemini calls.
+
+    One pooled requests.Session (sized to the synthesis concurrency), default timeouts, retries on
+    connection errors and 429/5xx with jittered exponential backoff (honouring Retry-After), and a
+    latency histogram per endpoint.
+    """
+
+    def __init__(self, pool_size=10, timeout=(5, 60), retries=3, backoff=0.5, max_backoff=10.0, profiler=None):
+        self.timeout = timeout
+        self.profiler = profiler
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = self._open(pool_size)
+        self.latency = {}
+        self.retry_count = 0
+        self._lock = threading.Lock()
+
+    def _open(self, pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _observe(self, endpoint, seconds):
+        with self._lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = LatencyHistogram()
+            histogram = self.latency[endpoint]
+        histogram.observe(seconds)
+        if self.profiler is not None:
+            self.profiler.observe_latency(endpoint, seconds)
+
+    def _delay(self, attempt, resp=None):
+        retry_after = resp.headers.get('Retry-After') if resp is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # full jitter: uniform in [0, backoff * 2^attempt], capped
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """Send a request with retries. Returns the last response (callers still raise_for_status)."""
+        endpoint = endpoint or urlparse(url).netloc + urlparse(url).path
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._observe(endpoint, time.perf_counter() - start)
+                if attempt == self.retries:
+                    raise
+                resp = None
+            else:
+                self._observe(endpoint, time.perf_counter() - start)
+                if resp.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return resp
+            with self._lock:
+                self.retry_count += 1
+            if self.profiler is not None:
+                self.profiler.count('http_retries')
+            time.sleep(self._delay(attempt, resp))
+
+    def bound_to(self, profiler):
+        """This client reporting to profiler (e.g. one render's): same connection pool and latency
+        histograms, its own retry_count."""
+        view = copy.copy(self)
+        view.profiler = profiler
+        view.retry_count = 0
+        return view
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request('GET', url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request('POST', url, endpoint=endpoint, **kwargs)
+
+    def latency_stats(self):
+        with self._lock:
+            endpoints = dict(self.latency)
+        return {endpoint: histogram.to_dict() for endpoint, histogram in endpoints.items()}
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHttpClient(HttpClient):
+    """asyncio twin of HttpClient on one pooled httpx.AsyncClient: same timeouts, retry/backoff and histograms."""
+
+    def _open(self, pool_size):
+        if httpx is None:
+            raise RuntimeError("AsyncHttpClient needs httpx (pip install httpx)")
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        return httpx.AsyncClient(limits=limits, timeout=self._timeout(self.timeout))
+
+    @staticmethod
+    def _timeout(timeout):
+        # requests-style (connect, read) tuples
+        if isinstance(timeout, tuple):
+            return httpx.Timeout(timeout[1], connect=timeout[0])
+        return timeout
+
+    async def request(self, method, url, endpoint=None, **kwargs):
+        """Send a request with retries. Returns the last response (callers still raise_for_status)."""
+        endpoint = endpoint or urlparse(url).netloc + urlparse(url).path
+        kwargs['timeout'] = self._timeout(kwargs.get('timeout', self.timeout))
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                resp = await self.session.request(method, url, **kwargs)
+            except httpx.TransportError:
+                self._observe(endpoint, time.perf_counter() - start)
+                if attempt == self.retries:
+                    raise
+                resp = None
+            else:
+                self._observe(endpoint, time.perf_counter() - start)
+                if resp.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return resp
+            with self._lock:
+                self.retry_count += 1
+            if self.profiler is not None:
+                self.profiler.count('http_retries')
+            await asyncio.sleep(self._delay(attempt, resp))
+
+    async def get(self, url, endpoint=None, **kwargs):
+        return await self.request('GET', url, endpoint=endpoint, **kwargs)
+
+    async def post(self, url, endpoint=None, **kwargs):
+        return await self.request('POST', url, endpoint=endpoint, **kwargs)
+
+    async def close(self):
+        await self.session.aclose()
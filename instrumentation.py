@@ -0,0 +1,204 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: no child CPU accounting
+    resource = None
+
+from http_client import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # recent durations only, so long-running aggregates stay bounded
+        self.durations = deque(maxlen=4096)
+
+    def add(self, wall, cpu, bytes_in, bytes_out):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.durations.append(wall)
+
+    def to_dict(self):
+        durations = sorted(self.durations)
+
+        def pct(p):
+            return durations[min(len(durations) - 1, int(p * len(durations)))] if durations else 0.0
+        return {
+            'count': self.count,
+            'wall_s': self.wall,
+            'cpu_s': self.cpu,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'wall_p50_s': pct(0.50),
+            'wall_p95_s': pct(0.95),
+            'wall_p99_s': pct(0.99),
+        }
+
+
+class Profiler:
+    """Per-stage wall/CPU time, bytes in/out and counters (subprocesses, cache hits, ...) for a render.
+
+    Stage CPU is the calling thread's CPU time plus the CPU of any child processes it waited for.
+    Every record is also forwarded to `parent` (by default the process-wide METRICS), which app.py
+    exposes in Prometheus text format.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.stages = {}
+        self.counters = {}
+        self.latency = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.latency = {}
+
+    def _child_cpu(self):
+        return getattr(self._local, 'child_cpu', 0.0)
+
+    @contextmanager
+    def stage(self, name, bytes_in=0):
+        """Time a block. Bytes can be added with add_bytes() from inside it."""
+        record = {'bytes_in': bytes_in, 'bytes_out': 0}
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(record)
+        wall0, cpu0, child0 = time.perf_counter(), time.thread_time(), self._child_cpu()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu = time.thread_time() - cpu0 + self._child_cpu() - child0
+            stack.remove(record)
+            self.add_stage(name, wall, cpu, record['bytes_in'], record['bytes_out'])
+
+    def add_bytes(self, bytes_in=0, bytes_out=0):
+        """Charge bytes to the innermost stage running in this thread."""
+        stack = getattr(self._local, 'stack', None)
+        if stack:
+            stack[-1]['bytes_in'] += bytes_in
+            stack[-1]['bytes_out'] += bytes_out
+
+    def add_stage(self, name, wall, cpu, bytes_in=0, bytes_out=0):
+        with self._lock:
+            self.stages.setdefault(name, StageStats()).add(wall, cpu, bytes_in, bytes_out)
+        if self.parent is not None:
+            self.parent.add_stage(name, wall, cpu, bytes_in, bytes_out)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        if self.parent is not None:
+            self.parent.count(name, n)
+
+    def observe_latency(self, endpoint, seconds):
+        with self._lock:
+            histogram = self.latency.setdefault(endpoint, LatencyHistogram())
+        histogram.observe(seconds)
+        if self.parent is not None:
+            self.parent.observe_latency(endpoint, seconds)
+
+    def run(self, cmd, **kwargs):
+        """subprocess.run, counted, with the child's CPU time charged to the current stage."""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[FFMPEG CMD] %s", ' '.join(str(c) for c in cmd))
+        before = resource.getrusage(resource.RUSAGE_CHILDREN) if resource else None
+        try:
+            return subprocess.run(cmd, **kwargs)
+        finally:
+            self.count('subprocesses')
+            if resource:
+                # process-wide counter, so approximate when several children finish at once
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+                self._local.child_cpu = self._child_cpu() + cpu
+                self.count('subprocess_cpu_ms', int(cpu * 1000))
+
+    def report(self):
+        with self._lock:
+            stages = {name: stats.to_dict() for name, stats in self.stages.items()}
+            counters = dict(self.counters)
+            latency = dict(self.latency)
+        return {
+            'stages': stages,
+            'counters': counters,
+            'http_latency': {endpoint: h.to_dict() for endpoint, h in latency.items()},
+        }
+
+    def write_report(self, path, **extra):
+        report = dict(self.report(), **extra)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logger.info("Render report written to %s", path)
+        return report
+
+    def prometheus(self, prefix='audio5d'):
+        """Render all metrics in Prometheus text exposition format."""
+        report = self.report()
+        lines = []
+        for metric, key, help_text in (
+            ('stage_calls_total', 'count', 'Stage invocations'),
+            ('stage_wall_seconds_total', 'wall_s', 'Stage wall time'),
+            ('stage_cpu_seconds_total', 'cpu_s', 'Stage CPU time'),
+            ('stage_bytes_in_total', 'bytes_in', 'Bytes read by stage'),
+            ('stage_bytes_out_total', 'bytes_out', 'Bytes written by stage'),
+        ):
+            lines.append(f'# HELP {prefix}_{metric} {help_text}')
+            lines.append(f'# TYPE {prefix}_{metric} counter')
+            for stage, stats in report['stages'].items():
+                lines.append(f'{prefix}_{metric}{{stage="{stage}"}} {stats[key]}')
+        for name, value in report['counters'].items():
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        lines.append(f'# TYPE {prefix}_http_request_seconds histogram')
+        for endpoint, h in report['http_latency'].items():
+            for bound, count in h['buckets'].items():
+                lines.append(f'{prefix}_http_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_http_request_seconds_sum{{endpoint="{endpoint}"}} {h["sum"]}')
+            lines.append(f'{prefix}_http_request_seconds_count{{endpoint="{endpoint}"}} {h["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def profiled(stage):
+    """Method decorator: run the method (or generator) inside self.profiler.stage(stage)."""
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(self, *args, **kwargs):
+                with self.profiler.stage(stage):
+                    yield from fn(self, *args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.stage(stage):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# process-wide aggregate of every render, for the /metrics endpoint
+METRICS = Profiler()
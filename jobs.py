@@ -0,0 +1,151 @@
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from audio_processor import AudioProcessor, timing_path
+from effects_scheduler import process_context
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised by JobManager.submit when the job queue is at capacity."""
+
+
+def render_story_job(job_id, chunks, work_dir, progress, ffmpeg_bin=None, seed=None):
+    """Render one story into work_dir/story.<ext>, reporting chunks done in progress[job_id].
+
+    Module-level so it can run in a worker process as well as a thread.
+    """
+    progress[job_id] = 0
+    proc = AudioProcessor(ffmpeg_bin=ffmpeg_bin, seed=seed)
+    chunk_outs = [os.path.join(work_dir, f"chunk_{i}.wav") for i in range(len(chunks))]
+    segments_dir = os.path.join(work_dir, "segments")
+    for i, _ in enumerate(proc.iter_chunks(chunks, chunk_outs, segments_dir)):
+        progress[job_id] = i + 1
+    final_out = os.path.join(work_dir, "story" + proc.output_ext)
+    proc.concat_files(chunk_outs, final_out)
+    proc.write_report(job_id=job_id, chunks=len(chunks))
+    for path in chunk_outs:
+        os.remove(path)
+        os.remove(timing_path(path))
+    return final_out
+
+
+class Job:
+    def __init__(self, job_id, chunks, work_dir, seed=None):
+        self.id = job_id
+        self.chunks = chunks
+        self.work_dir = work_dir
+        # jitter seed of the render, so its preview (app.py) plans the same lines and shares their TTS
+        self.seed = seed
+        self.status = 'queued'
+        self.error = None
+        self.output = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self, chunks_done=0):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': {'done': chunks_done, 'total': len(self.chunks)},
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """In-process job broker: a bounded queue in front of a thread or process worker pool.
+
+    Each job renders in its own work directory, so concurrent renders never share temp files.
+    """
+
+    def __init__(self, ffmpeg_bin=None, max_workers=2, max_queue=8, executor='thread',
+                 jobs_dir=None, job_ttl=3600):
+        self.ffmpeg_bin = ffmpeg_bin
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.jobs_dir = jobs_dir or os.path.join(tempfile.gettempdir(), 'audio5d_jobs')
+        self.job_ttl = job_ttl
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        if executor == 'process':
+            self._manager = process_context().Manager()
+            self._progress = self._manager.dict()
+            self._pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=process_context())
+        elif executor == 'thread':
+            self._progress = {}
+            self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f"Unknown executor: {executor}")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _pending(self):
+        return sum(1 for job in self._jobs.values() if job.status in ('queued', 'running'))
+
+    def submit(self, chunks, seed=None):
+        """Queue a render for the given chunks. Raises QueueFullError when the queue is full.
+
+        Without a seed (or RENDER_SEED) the job gets a random one.
+        """
+        if seed is None:
+            seed = os.getenv("RENDER_SEED") or random.getrandbits(32)
+        self.purge()
+        with self._lock:
+            if self._pending() >= self.max_workers + self.max_queue:
+                raise QueueFullError("Render queue is full, try again later.")
+            job_id = uuid.uuid4().hex
+            job = Job(job_id, chunks, tempfile.mkdtemp(prefix=f"{job_id}_", dir=self.jobs_dir), seed)
+            self._jobs[job_id] = job
+        future = self._pool.submit(render_story_job, job_id, chunks, job.work_dir, self._progress, self.ffmpeg_bin,
+                                   seed)
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return job
+
+    def _finish(self, job, future):
+        with self._lock:
+            job.finished = time.time()
+            if future.cancelled():
+                job.status = 'cancelled'
+                return
+            try:
+                job.output = future.result()
+                job.status = 'done'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+                logger.error("Job %s failed: %s", job.id, e)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job.status == 'queued' and job_id in self._progress:
+                job.status = 'running'
+            return job
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        return job.to_dict(self._progress.get(job_id, len(job.chunks) if job.status == 'done' else 0))
+
+    def purge(self):
+        """Forget finished jobs older than job_ttl and delete their work directories."""
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job.finished and now - job.finished > self.job_ttl]
+            for job in expired:
+                del self._jobs[job.id]
+                self._progress.pop(job.id, None)
+        for job in expired:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,158 @@
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from contextlib import closing
+
+import numpy as np
+
+import dsp
+from audio_processor import timing_path
+from cue_matcher import AMBIENT_CUES
+
+logger = logging.getLogger(__name__)
+
+# a paragraph that is only '***', '# ...' or 'Chapter ...' starts a new scene and ends its ambience
+SCENE_BREAK = re.compile(r'^\s*(\*\s*\*\s*\*[\s*]*|#.*|chapter\b.*)$', re.IGNORECASE)
+AMBIENCE_FADE = 2.0
+MIX_BLOCK = 10 * dsp.SAMPLE_RATE
+
+
+def iter_paragraphs(path):
+    """Yield the paragraphs of a text file (separated by blank lines), reading it line by line."""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = []
+        for line in f:
+            if line.strip():
+                lines.append(line.rstrip('\n'))
+            elif lines:
+                yield '\n'.join(lines)
+                lines = []
+        if lines:
+            yield '\n'.join(lines)
+
+
+def iter_chunks(path, clean, split):
+    """Yield (scene, chunk) for a manuscript on disk: each paragraph cleaned and split, scene breaks counted."""
+    scene = 0
+    for paragraph in iter_paragraphs(path):
+        if SCENE_BREAK.match(paragraph):
+            scene += 1
+            continue
+        for chunk in split(clean(paragraph)):
+            if chunk.strip():
+                yield scene, chunk
+
+
+class AmbiencePlan:
+    """Ambient beds on the story timeline: a bed starts where its cue is first mentioned and runs to the end of the scene."""
+
+    def __init__(self):
+        self.beds = []  # (cue, start_sample, end_sample)
+        self._active = {}
+        self._scene = None
+
+    def add_chunk(self, scene, cues, start):
+        if scene != self._scene:
+            self.end_scene(start)
+            self._scene = scene
+        for cue in AMBIENT_CUES:
+            if cue in cues and cue not in self._active:
+                self._active[cue] = start
+
+    def end_scene(self, end):
+        for cue, start in self._active.items():
+            if end > start:
+                self.beds.append((cue, start, end))
+        self._active = {}
+
+
+def _bed_block(bed, bed_start, bed_end, start, stop):
+    """Samples [start, stop) of a looping bed placed at [bed_start, bed_end), faded in and out."""
+    t = np.arange(max(start, bed_start), min(stop, bed_end))
+    fade = AMBIENCE_FADE * dsp.SAMPLE_RATE
+    env = np.minimum(1.0, np.minimum(t - bed_start, bed_end - t) / fade).astype(np.float32)
+    return t - start, bed.take((t - bed_start) % len(bed), axis=0) * env[:, None]
+
+
+def render_book(proc, path, final_out, work_dir="temp_longform", clean=None, split=None, batch_size=16, seed=None):
+    """Render a manuscript of any length into final_out with bounded memory.
+
+    Paragraphs are streamed from disk and rendered `batch_size` chunks at a time without ambience.
+    Each finished chunk is appended to a raw float32 voice timeline on disk. Ambient beds are planned
+    per scene across chunk boundaries, then mixed over the whole timeline in one block-wise pass
+    that feeds a single encode. The chunks' timing sidecars are merged into final_out's, which is
+    written line by line as the chunks finish.
+    """
+    clean = clean or (lambda text: text)
+    split = split or (lambda text: [text])
+    os.makedirs(work_dir, exist_ok=True)
+    timeline_path = os.path.join(work_dir, 'voice.f32')
+    timing_tmp = os.path.join(work_dir, 'timing.json')
+    plan = AmbiencePlan()
+    position = 0
+    chunks = iter_chunks(path, clean, split)
+    try:
+        with open(timeline_path, 'wb') as timeline, open(timing_tmp, 'w', encoding='utf-8') as timing:
+            timing.write('{"lines": [')
+            separator = '\n'
+            for batch_index in itertools.count():
+                batch = list(itertools.islice(chunks, batch_size))
+                if not batch:
+                    break
+                texts = [chunk for _, chunk in batch]
+                outs = [os.path.join(work_dir, f'chunk_{i}.wav') for i in range(len(batch))]
+                # closed before the next batch, so the render's cleanup and stage run now, not at GC
+                with closing(proc.iter_chunks(texts, outs, os.path.join(work_dir, 'segments'),
+                                              seed=seed, ambience=False)) as rendered:
+                    for chunk_index, ((scene, text), out) in enumerate(zip(batch, rendered), batch_index * batch_size):
+                        plan.add_chunk(scene, proc.detect_cues(text)['ambient'], position)
+                        offset = position / dsp.SAMPLE_RATE
+                        with open(timing_path(out), 'r', encoding='utf-8') as f:
+                            for line in json.load(f)['lines']:
+                                timing.write(separator + json.dumps(dict(
+                                    line, chunk=chunk_index, start=round(line['start'] + offset, 3),
+                                    end=round(line['end'] + offset, 3))))
+                                separator = ',\n'
+                        samples = proc.decode(out)
+                        timeline.write(np.ascontiguousarray(samples, dtype=np.float32).tobytes())
+                        position += len(samples)
+                        os.remove(out)
+                logger.info("Long-form: %d chunk(s) rendered, %.1f min of audio", batch_index * batch_size + len(batch),
+                            position / dsp.SAMPLE_RATE / 60)
+            timing.write(f'\n], "duration": {round(position / dsp.SAMPLE_RATE, 3)}}}\n')
+        plan.end_scene(position)
+        mix_timeline(proc, timeline_path, position, plan.beds, final_out)
+        shutil.move(timing_tmp, timing_path(final_out))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return final_out
+
+
+def mix_timeline(proc, timeline_path, length, beds, final_out):
+    """Lay the ambient beds over the voice timeline block by block, streaming into one encode."""
+    voice = np.memmap(timeline_path, dtype=np.float32, mode='r', shape=(length, dsp.CHANNELS)) if length else None
+    buffers = {cue: proc.sfx.pcm(cue) for cue in {cue for cue, _, _ in beds}}
+    with proc.scheduler.ffmpeg_slots, proc.profiler.stage('ambience_mix', bytes_in=length * dsp.CHANNELS * 4):
+        encoder = dsp.open_encoder(proc.ffmpeg, final_out, proc.bitrate)
+        proc.profiler.count('subprocesses')
+        try:
+            for start in range(0, max(length, 1), MIX_BLOCK):
+                stop = min(length, start + MIX_BLOCK)
+                block = np.array(voice[start:stop]) if length else dsp.silence(0.3)
+                for cue, bed_start, bed_end in beds:
+                    bed = buffers.get(cue)
+                    if bed is None or bed_end <= start or bed_start >= stop:
+                        continue
+                    offsets, samples = _bed_block(bed, bed_start, bed_end, start, stop)
+                    block[offsets] += samples * dsp.AMBIENCE_GAIN
+                encoder.stdin.write(np.clip(block, -1.0, 1.0).astype(np.float32).tobytes())
+        finally:
+            encoder.stdin.close()
+            if encoder.wait():
+                raise subprocess.CalledProcessError(encoder.returncode, encoder.args)
+        proc.profiler.add_bytes(bytes_out=os.path.getsize(final_out))
+    logger.info("Long-form: %d ambience bed(s) mixed over %.1f min -> %s", len(beds), length / dsp.SAMPLE_RATE / 60, final_out)
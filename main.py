@@ -1,20 +1,27 @@
-from audio_processor import AudioProcessor
+from audio_processor import AudioProcessor, timing_path
+from cue_matcher import SFX_CUES
+from render_manifest import RenderManifest
+from instrumentation import METRICS
 from dotenv import load_dotenv
 from pathlib import Path
+import logging
 import os
 import requests
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
-def clean_story_with_gemini(story_text):
+def clean_story_with_gemini(story_text, http=None, profiler=METRICS):
     """
     Use Gemini API to clean and validate the story text for TTS (remove unsupported characters, ensure proper punctuation, and keep it API-friendly).
+    Pass the AudioProcessor's `http` client to reuse its pooled session and retry/backoff, and its `profiler` to time the call in its report.
     """
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     if not gemini_api_key:
-        print("Gemini API key not set. Set GEMINI_API_KEY in your .env file.")
+        logger.warning("Gemini API key not set. Set GEMINI_API_KEY in your .env file.")
         return story_text
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-pro-latest:generateContent?key=" + gemini_api_key
+    base_url = os.getenv("GEMINI_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-pro-latest:generateContent")
+    url = base_url + "?key=" + gemini_api_key
     prompt = (
         "Clean up the following story for use with a TTS API. "
         "Ensure it is plain, well-punctuated, free of unsupported symbols, and not excessively long. "
@@ -22,18 +29,23 @@ def clean_story_with_gemini(story_text):
     )
     data = {"contents": [{"parts": [{"text": prompt}]}]}
     try:
-        resp = requests.post(url, json=data, timeout=30)
-        resp.raise_for_status()
-        result = resp.json()
+        with profiler.stage("gemini"):
+            if http is not None:
+                resp = http.post(url, endpoint="gemini", json=data, timeout=30)
+            else:
+                resp = requests.post(url, json=data, timeout=30)
+            resp.raise_for_status()
+            result = resp.json()
         cleaned = result["candidates"][0]["content"]["parts"][0]["text"]
         return cleaned.strip()
     except Exception as e:
-        print(f"Gemini API error: {e}")
+        logger.error("Gemini API error: %s", e)
         return story_text
 
 def local_clean_story(story_text, max_length=4000):
     """
     Clean the story text using a local fallback method (remove non-ASCII characters, ensure proper punctuation, and truncate if too long).
+    max_length=None keeps the whole text (long-form mode).
     """
     # Remove non-ASCII characters
     cleaned = ''.join(c if 32 <= ord(c) <= 126 or c in '\n\r' else ' ' for c in story_text)
@@ -41,12 +53,35 @@ def local_clean_story(story_text, max_length=4000):
     import re
     cleaned = re.sub(r'\s+', ' ', cleaned)
     # Truncate to max_length
-    cleaned = cleaned[:max_length]
+    if max_length:
+        cleaned = cleaned[:max_length]
     # Ensure it ends with a period
     if not cleaned.strip().endswith(('.', '!', '?')):
         cleaned = cleaned.strip() + '.'
     return cleaned
 
+def clean_story(story_text, http=None, profiler=METRICS, max_length=4000):
+    """Clean with Gemini, falling back to local cleaning if Gemini is unavailable or returns nothing."""
+    cleaned = clean_story_with_gemini(story_text, http=http, profiler=profiler)
+    if cleaned == story_text or cleaned.strip() == '':
+        logger.info("Using local fallback cleaning for story text.")
+        cleaned = local_clean_story(story_text, max_length=max_length)
+    return cleaned
+
+def incremental_chunks(story_text, manifest, http=None, max_chunk_length=950, profiler=METRICS):
+    """
+    Clean and chunk the story paragraph by paragraph, reusing cached cleaning for unchanged paragraphs.
+    Chunks never span paragraphs, so an edit only changes the chunks of the paragraph it is in.
+    """
+    import re
+    chunks = []
+    for paragraph in re.split(r'\n\s*\n', story_text):
+        if not paragraph.strip():
+            continue
+        cleaned = manifest.cleaned(paragraph, lambda p: clean_story(p, http=http, profiler=profiler))
+        chunks.extend(split_story_into_chunks(cleaned, max_chunk_length=max_chunk_length))
+    return chunks
+
 def split_story_into_chunks(story_text, max_chunk_length=1000):
     """
     Split the story into chunks (by sentence or paragraph) that are each <= max_chunk_length characters.
@@ -67,45 +102,61 @@ def split_story_into_chunks(story_text, max_chunk_length=1000):
     return chunks
 
 if __name__=="__main__":
-    ffmpeg = r"ffmpeg-master-latest-win64-gpl-shared\bin\ffmpeg.exe"
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    ffmpeg = os.getenv("FFMPEG_BIN", r"ffmpeg-master-latest-win64-gpl-shared\bin\ffmpeg.exe")
     proc = AudioProcessor(ffmpeg_bin=ffmpeg)
+    if os.getenv("SFX_PREFETCH", "0") == "1":
+        print(f"SFX library warm-up: {proc.sfx.prefetch(SFX_CUES)}")
     
     story_file = Path("story.txt")
     if not story_file.exists():
         print(f"Error: Input file not found at '{story_file}'")
+    elif os.getenv("LONGFORM", "0") == "1":
+        # Long-form: stream the manuscript from disk, no truncation, one ambience pass over the whole book
+        from longform import render_book
+        final_out = "aetherfall_immersive" + proc.output_ext
+        render_book(
+            proc, story_file, final_out, "temp_longform",
+            clean=lambda p: clean_story(p, http=proc.http, profiler=proc.profiler, max_length=None),
+            split=lambda text: split_story_into_chunks(text, max_chunk_length=950),
+            batch_size=int(os.getenv("LONGFORM_BATCH_CHUNKS", "16")),
+        )
+        print(f"Final audio created: {final_out}")
     else:
         with open(story_file, "r", encoding="utf-8") as f:
             story_text = f.read()
-        # Clean and validate story text using Gemini before processing
-        cleaned = clean_story_with_gemini(story_text)
-        if cleaned == story_text or cleaned.strip() == '':
-            print("Using local fallback cleaning for story text.")
-            cleaned = local_clean_story(story_text)
-        # Split into TTS-safe chunks
-        chunks = split_story_into_chunks(cleaned, max_chunk_length=950)
+        # INCREMENTAL_DIR keeps per-line fingerprints and rendered segments between runs,
+        # so re-running after an edit only re-renders the changed lines
+        incremental_dir = os.getenv("INCREMENTAL_DIR")
+        manifest = RenderManifest(incremental_dir) if incremental_dir else None
+        if manifest:
+            chunks = incremental_chunks(story_text, manifest, http=proc.http, profiler=proc.profiler)
+        else:
+            # Clean and validate story text using Gemini before processing
+            cleaned = clean_story(story_text, http=proc.http, profiler=proc.profiler)
+            # Split into TTS-safe chunks
+            chunks = split_story_into_chunks(cleaned, max_chunk_length=950)
         print(f"Processing story in {len(chunks)} chunks...")
-        temp_files = []
-        for i, chunk in enumerate(chunks):
-            temp_out = f"temp_audio_chunk_{i}.mp3"
-            proc.process_story(chunk, "temp_audio", temp_out)
-            temp_files.append(temp_out)
+        # All chunks share one concurrent TTS stage
+        # Chunks stay lossless (WAV); the final file is the only encode (OUTPUT_CODEC / OUTPUT_BITRATE)
+        temp_files = [f"temp_audio_chunk_{i}.wav" for i in range(len(chunks))]
+        proc.process_chunks(chunks, temp_files, "temp_audio", manifest=manifest)
+        if proc.tts_cache:
+            print(f"TTS cache: {proc.tts_cache.stats()}")
         # Concatenate all chunk outputs into the final file
         if temp_files:
-            concat_file = "concat_list.txt"
-            with open(concat_file, "w", encoding="utf-8") as f:
-                for tf in temp_files:
-                    f.write(f"file '{tf}'\n")
-            ffmpeg_bin = ffmpeg
-            final_out = "aetherfall_immersive.mp3"
-            os.system(f'"{ffmpeg_bin}" -y -f concat -safe 0 -i {concat_file} -c copy {final_out}')
+            final_out = "aetherfall_immersive" + proc.output_ext
+            proc.concat_files(temp_files, final_out)
             print(f"Final audio created: {final_out}")
-            # Clean up temp files
+            # Clean up temp files (and their timing sidecars; the final one is kept next to final_out)
             for tf in temp_files:
-                try:
-                    os.remove(tf)
-                except Exception:
-                    pass
-            try:
-                os.remove(concat_file)
-            except Exception:
-                pass
+                for path in (tf, timing_path(tf)):
+                    try:
+                        os.remove(path)
+                    except Exception:
+                        pass
+        # Per-stage timings (also written as JSON when RENDER_REPORT_DIR is set)
+        report = proc.write_report(chunks=len(chunks))
+        for stage, stats in report["stages"].items():
+            print(f"  {stage:<12} {stats['count']:>4} call(s)  wall {stats['wall_s']:7.2f}s  cpu {stats['cpu_s']:7.2f}s  p95 {stats['wall_p95_s']:.2f}s")
+        print(f"Subprocesses: {report['counters'].get('subprocesses', 0)}")
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RenderManifest:
+    """Fingerprints and rendered files from the previous run of a story, for incremental re-renders.
+
+    Rendered segments live in <root>/segments/<fingerprint>, finished chunks in <root>/chunks/<key>.<ext> and
+    the fingerprints of the last run in <root>/manifest.json. A segment's fingerprint covers everything that
+    affects its audio (text, voice, emotion params, SFX, pan/reverb settings, effects and TTS backends), so an
+    unchanged line is reused as-is and only edited lines are synthesized and rendered again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.segments_dir = os.path.join(root, "segments")
+        self.chunks_dir = os.path.join(root, "chunks")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        self.path = os.path.join(root, "manifest.json")
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.previous = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.previous = {}
+        self.clean_cache = dict(self.previous.get("clean", {}))
+        self._clean_used = set()
+        self.lines = []
+        self.chunks = []
+        self.reused = 0
+        self.rendered = 0
+
+    @staticmethod
+    def fingerprint(seg, backend, tts="unreal"):
+        return _hash({
+            "text": seg["text"], "voice": seg["voice"],
+            "speed": seg["speed"], "pitch": seg["pitch"], "volume": seg["volume"],
+            "effects": seg["effects"], "backend": backend, "tts": tts,
+        })
+
+    def attach(self, segments, backend, chunk_index, tts="unreal"):
+        """Point each segment's output at the persistent store and mark the ones already rendered."""
+        ext = ".npy" if backend == "numpy" else ".wav"
+        for seg in segments:
+            fp = self.fingerprint(seg, backend, tts)
+            seg["fingerprint"] = fp
+            seg["out"] = os.path.join(self.segments_dir, fp + ext)
+            seg["cached"] = os.path.exists(seg["out"])
+            if seg["cached"]:
+                self.reused += 1
+            else:
+                self.rendered += 1
+            self.lines.append({"chunk": chunk_index, "index": seg["index"], "text": seg["text"], "fingerprint": fp})
+
+    def chunk_path(self, segments, ext=".wav"):
+        """Stored output for a chunk made of exactly these segments, in order, in the format of ext.
+
+        The key also covers what is applied at the join: the narration pan rate and the ambient beds.
+        """
+        key = _hash([[seg["fingerprint"], seg.get("pulsator"), seg.get("ambient")]
+                     for seg in sorted(segments, key=lambda s: s["index"])])
+        self.chunks.append(key)
+        return os.path.join(self.chunks_dir, key + ext)
+
+    def cleaned(self, paragraph, clean):
+        """clean(paragraph), reusing the previous run's result for an unchanged paragraph."""
+        key = _hash(paragraph)
+        if key not in self.clean_cache:
+            self.clean_cache[key] = clean(paragraph)
+        self._clean_used.add(key)
+        return self.clean_cache[key]
+
+    def save(self):
+        """Write the manifest for this run and drop stored files no longer referenced."""
+        with open(self.path, "w", encoding="utf-8") as f:
+            clean = {k: v for k, v in self.clean_cache.items() if k in self._clean_used}
+            json.dump({"lines": self.lines, "chunks": self.chunks, "clean": clean}, f, indent=2)
+        keep = {line["fingerprint"] for line in self.lines}
+        for name in os.listdir(self.segments_dir):
+            if os.path.splitext(name)[0] not in keep:
+                os.remove(os.path.join(self.segments_dir, name))
+        keep = set(self.chunks)
+        for name in os.listdir(self.chunks_dir):
+            # chunks are stored with their timing sidecar, <key>.timing.json
+            if name.split(".")[0] not in keep:
+                os.remove(os.path.join(self.chunks_dir, name))
+        logger.info("Incremental render: %d segment(s) rendered, %d reused", self.rendered, self.reused)
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from audio_processor import timing_path
+
+logger = logging.getLogger(__name__)
+
+
+class RenderAbandoned(Exception):
+    """Set on a coalesced render whose leader gave up (e.g. its client disconnected); waiters retry."""
+
+
+class ResultCache:
+    """Finished stories keyed by normalized text, voice map and effect settings.
+
+    Entries are <key><ext> files (with their timing sidecar) in cache_dir, dropped after max_age
+    seconds and evicted least recently used beyond max_bytes. Identical requests that arrive while
+    the first is still rendering share its render instead of starting their own (see render/claim).
+    Coalescing is per process; entries on disk are shared by every process using cache_dir.
+    """
+
+    def __init__(self, cache_dir="result_cache", max_bytes=1024 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize(story_text):
+        """Whitespace-insensitive form of a story: stripped, single-spaced lines, no blank lines."""
+        return '\n'.join(' '.join(line.split()) for line in story_text.splitlines() if line.strip())
+
+    @classmethod
+    def key(cls, story_text, voices, settings):
+        payload = json.dumps([cls.normalize(story_text), voices, settings], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key + ext)
+
+    def get(self, key, ext):
+        """Path of the cached result for key (marked recently used), or None if missing or expired."""
+        path = self._path(key, ext)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if self.max_age and time.time() - st.st_mtime > self.max_age:
+            self._remove(path)
+            return None
+        # mtime is when it was rendered, atime when it was last served
+        os.utime(path, (time.time(), st.st_mtime))
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def claim(self, key):
+        """(future, leader). The leader must commit() or abandon(); the others wait on future.result()."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            self.misses += 1
+            return future, True
+
+    def temp_path(self, key, ext):
+        return f"{self._path(key, '')}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+
+    def commit(self, key, ext, tmp):
+        """Move the leader's finished file (and its timing sidecar) into the cache and wake the waiters."""
+        path = self._path(key, ext)
+        if os.path.exists(timing_path(tmp)):
+            os.replace(timing_path(tmp), timing_path(path))
+        os.replace(tmp, path)
+        with self._lock:
+            future = self._inflight.pop(key)
+        future.set_result(path)
+        self.evict()
+        return path
+
+    def abandon(self, key, tmp=None, exc=None):
+        """Give up a claimed render: clean up tmp and hand waiters exc (RenderAbandoned by default)."""
+        for path in (tmp, tmp and timing_path(tmp)):
+            if path and os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            future = self._inflight.pop(key)
+        future.set_exception(exc or RenderAbandoned())
+
+    def render(self, key, ext, fn):
+        """Path of the cached result for key, calling fn(out_path) to produce it on a miss.
+
+        Concurrent calls for the same key run fn once: the first caller renders, the others wait for its file.
+        """
+        while True:
+            path = self.get(key, ext)
+            if path:
+                return path
+            future, leader = self.claim(key)
+            if not leader:
+                try:
+                    return future.result()
+                except RenderAbandoned:
+                    continue
+            tmp = self.temp_path(key, ext)
+            try:
+                fn(tmp)
+            except BaseException as e:
+                self.abandon(key, tmp, e if isinstance(e, Exception) else None)
+                raise
+            return self.commit(key, ext, tmp)
+
+    def _entries(self):
+        """(last used, rendered, size, paths) per cached result, sidecar included."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if '.tmp' in name or name.endswith('.timing.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            paths = [path, timing_path(path)]
+            size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+            entries.append((st.st_atime, st.st_mtime, size, paths))
+        return entries
+
+    def _remove(self, path):
+        for p in (path, timing_path(path)):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Drop expired results, then least recently used ones until the cache fits in max_bytes."""
+        with self._lock:
+            now = time.time()
+            total = 0
+            live = []
+            for used, created, size, paths in self._entries():
+                if self.max_age and now - created > self.max_age:
+                    self._remove(paths[0])
+                else:
+                    live.append((used, size, paths))
+                    total += size
+            for _, size, paths in sorted(live):
+                if total <= self.max_bytes:
+                    break
+                self._remove(paths[0])
+                total -= size
+                logger.info("Result cache: evicted %s", os.path.basename(paths[0]))
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
@@ -0,0 +1,137 @@
+import copy
+import json
+import logging
+import os
+import subprocess
+import threading
+
+import numpy as np
+
+import dsp
+
+# loudness every library clip is pre-normalized to before mixing
+REFERENCE_LUFS = -23.0
+
+logger = logging.getLogger(__name__)
+
+_pcm_cache = {}
+_pcm_lock = threading.Lock()
+# one lock per library file, shared by every SFXLibrary in the process (index route, jobs, prefetch)
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+def _path_lock(path):
+    with _path_locks_lock:
+        return _path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class SFXLibrary:
+    """Persistent SFX store: one file per cue plus an index.json with duration, license and loudness.
+
+    Each clip is decoded once and stored next to it as loudness-normalized float32 PCM (<cue>.npy), so
+    renders never re-download or re-decode the same ambience; they memory-map it instead. With offline=True only local files are used.
+    """
+
+    def __init__(self, root="sfx", ffmpeg="ffmpeg", fetch=None, offline=False, run=subprocess.run):
+        self.root = root
+        self.ffmpeg = ffmpeg
+        self.run = run
+        self.fetch = fetch
+        self.offline = offline
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(root, "index.json")
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_index(self):
+        # merge with entries written by other processes since we loaded
+        merged = self._load_index()
+        merged.update(self.index)
+        # in place, so views from bound_to() keep sharing it
+        self.index.update(merged)
+        tmp = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(merged, f, indent=2)
+        os.replace(tmp, self.index_path)
+
+    def bound_to(self, run, fetch):
+        """This library running ffmpeg with `run` and fetching with `fetch` (e.g. one render's profiled
+        ones); the index is shared."""
+        view = copy.copy(self)
+        view.run = run
+        view.fetch = fetch
+        return view
+
+    def path(self, cue):
+        return os.path.join(self.root, f"{cue}.mp3")
+
+    def get(self, cue):
+        """Return the local file for cue, indexing local files and fetching missing ones unless offline."""
+        path = self.path(cue)
+        with _path_lock(path):
+            if cue in self.index and os.path.exists(path):
+                return path
+            info = {}
+            if not os.path.exists(path):
+                if self.offline or self.fetch is None:
+                    return None
+                logger.info("SFX '%s' not in library. Attempting to fetch from Freesound...", cue)
+                info = self.fetch(cue, path)
+                if not info or not os.path.exists(path):
+                    return None
+            self._index_file(cue, path, info if isinstance(info, dict) else {})
+            return path
+
+    def _index_file(self, cue, path, info):
+        samples = dsp.decode(self.ffmpeg, path, run=self.run)
+        loudness = dsp.integrated_loudness(samples)
+        gain = 10 ** ((REFERENCE_LUFS - loudness) / 20) if loudness > -70.0 else 1.0
+        pcm_path = os.path.join(self.root, f"{cue}.npy")
+        # write aside and swap in, so renders that have the previous file mapped keep reading it
+        tmp = f"{pcm_path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+        np.save(tmp, (samples * gain).astype(np.float32))
+        os.replace(tmp, pcm_path)
+        self.index[cue] = {
+            "file": os.path.basename(path),
+            "pcm": os.path.basename(pcm_path),
+            "duration": len(samples) / dsp.SAMPLE_RATE,
+            "loudness": loudness,
+            "license": info.get("license"),
+            "source": info.get("source", "local"),
+        }
+        self._save_index()
+
+    def pcm_path(self, cue):
+        """Path of the pre-decoded, loudness-normalized .npy for cue, or None if unavailable."""
+        if self.get(cue) is None:
+            return None
+        return os.path.join(self.root, self.index[cue]["pcm"])
+
+    def pcm(self, cue):
+        """Pre-decoded, loudness-normalized float32 (n, 2) buffer for cue, or None if unavailable.
+
+        The buffer is a read-only memory map: concurrent renders, in any process, share one copy
+        in the page cache and only touch the slices they mix.
+        """
+        pcm_path = self.pcm_path(cue)
+        if pcm_path is None:
+            return None
+        key = (pcm_path, os.path.getmtime(pcm_path))
+        with _pcm_lock:
+            if key not in _pcm_cache:
+                # drop the map of a replaced file (renders still holding it keep their own reference)
+                for stale in [k for k in _pcm_cache if k[0] == pcm_path]:
+                    del _pcm_cache[stale]
+                _pcm_cache[key] = np.load(pcm_path, mmap_mode='r')
+            return _pcm_cache[key]
+
+    def prefetch(self, cues):
+        """Warm the library: make sure every cue is downloaded, indexed and pre-decoded."""
+        return {cue: self.get(cue) is not None for cue in cues}
@@ -0,0 +1,187 @@
+import logging
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+
+try:
+    import pyttsx3
+except ImportError:  # only needed by the local backend (TTS_BACKEND=local)
+    pyttsx3 = None
+
+logger = logging.getLogger(__name__)
+
+
+class TTSBackend:
+    """Speech engine behind AudioProcessor.text_to_mp3: one line at a time, or a batch in one call.
+
+    `ext` is the container the engine writes raw clips in (they are decoded by ffmpeg, so any format
+    works). Backends with `batch = True` synthesize a whole plan through synthesize_batch, which the
+    pipeline then prefers over one call per line.
+    """
+
+    name = None
+    ext = '.mp3'
+    batch = False
+
+    def synthesize(self, text, voice_id, out_path, speed='0', pitch='1', volume='1'):
+        raise NotImplementedError
+
+    def synthesize_batch(self, lines):
+        """Synthesize (text, voice_id, out_path, speed, pitch, volume) tuples."""
+        for line in lines:
+            self.synthesize(*line)
+
+
+class UnrealSpeechBackend(TTSBackend):
+    """The Unreal Speech HTTP API, through the processor's pooled client, rate limiter and TTS cache."""
+
+    name = 'unreal'
+
+    def __init__(self, proc):
+        self.proc = proc
+
+    def synthesize(self, text, voice_id, out_path, speed='0', pitch='1', volume='1'):
+        proc = self.proc
+        key, body = proc.tts_request(text, voice_id, speed, pitch, volume)
+
+        def request():
+            proc.rate_limiter.wait()
+            resp = proc.http.post(
+                proc.tts_url,
+                endpoint="unrealspeech",
+                headers={"Authorization": f"Bearer {proc.api_key}"},
+                json=body,
+            )
+            resp.raise_for_status()
+            return resp.content
+
+        content, fetched = proc.tts_cache.fetch(key, request) if key else (request(), True)
+        proc.profiler.count('tts_cache_misses' if fetched else 'tts_cache_hits')
+        with open(out_path, "wb") as f:
+            f.write(content)
+
+
+def _gender(voice):
+    gender = str(getattr(voice, 'gender', None) or '').lower()
+    return 'female' if 'female' in gender else 'male' if 'male' in gender else None
+
+
+class LocalBackend(TTSBackend):
+    """Offline synthesis with pyttsx3 (SAPI5 on Windows, NSSpeechSynthesizer on macOS, eSpeak elsewhere).
+
+    Each Unreal voice id is played by an installed voice of the same gender (`af_*`/`bf_*` female,
+    `am_*`/`bm_*` male), a different one per id where the system has enough, else the engine's default
+    voice; `overrides` maps a voice id to an installed voice id or name instead. Speed scales the
+    engine's speaking rate and volume its output level; pyttsx3 has no pitch control, so pitch is
+    ignored. A batch is queued on the engine and spoken in a single run. SAPI5 and NSSpeechSynthesizer
+    must be driven from the thread that created them, so one engine serves the whole process from its
+    own thread; synthesize_batch posts the batch there and waits for it.
+    """
+
+    name = 'local'
+    # NSSpeechSynthesizer writes AIFF whatever the file is called
+    ext = '.aiff' if sys.platform == 'darwin' else '.wav'
+    batch = True
+
+    _engine = None
+    _requests = None
+    _start_lock = threading.Lock()
+
+    def __init__(self, overrides=None, driver=None):
+        if pyttsx3 is None:
+            raise RuntimeError("TTS_BACKEND=local needs pyttsx3 (pip install pyttsx3).")
+        self.overrides = overrides or {}
+        self.driver = driver or os.getenv("TTS_LOCAL_DRIVER") or None
+        self._voices = {}
+
+    def _get_engine(self):
+        # only called on the engine thread
+        if LocalBackend._engine is None:
+            LocalBackend._engine = pyttsx3.init(self.driver)
+            LocalBackend._base_rate = LocalBackend._engine.getProperty('rate')
+            LocalBackend._default_voice = LocalBackend._engine.getProperty('voice')
+        return LocalBackend._engine
+
+    @staticmethod
+    def _serve(requests):
+        while True:
+            fn, future = requests.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn())
+                except BaseException as e:
+                    future.set_exception(e)
+
+    def _on_engine_thread(self, fn):
+        """Run fn() on the thread that owns the engine (started on first use) and return its result."""
+        with LocalBackend._start_lock:
+            if LocalBackend._requests is None:
+                LocalBackend._requests = queue.Queue()
+                threading.Thread(target=self._serve, args=(LocalBackend._requests,),
+                                 name='pyttsx3-engine', daemon=True).start()
+        future = Future()
+        LocalBackend._requests.put((fn, future))
+        return future.result()
+
+    def voice(self, voice_id):
+        """Installed voice id for an Unreal voice id (None: the engine's default voice)."""
+        if voice_id in self._voices:
+            return self._voices[voice_id]
+        installed = self._get_engine().getProperty('voices') or []
+        wanted = self.overrides.get(voice_id)
+        if wanted:
+            matches = [v for v in installed if wanted.lower() in (v.id.lower(), v.name.lower())]
+            matches = matches or [v for v in installed if wanted.lower() in v.name.lower()]
+            if not matches:
+                logger.warning("Local TTS: no installed voice matches '%s', using the default for %s", wanted, voice_id)
+        else:
+            gender = {'f': 'female', 'm': 'male'}.get(voice_id.split('_')[0][-1:])
+            used = set(self._voices.values())
+            same = [v for v in installed if _gender(v) == gender]
+            # a voice of the right gender not taken by another role if there is one
+            matches = [v for v in same if v.id not in used] or same
+        self._voices[voice_id] = matches[0].id if matches else None
+        logger.info("Local TTS: %s -> %s", voice_id, self._voices[voice_id] or 'default voice')
+        return self._voices[voice_id]
+
+    def synthesize(self, text, voice_id, out_path, speed='0', pitch='1', volume='1'):
+        self.synthesize_batch([(text, voice_id, out_path, speed, pitch, volume)])
+
+    def synthesize_batch(self, lines):
+        if not lines:
+            return
+        self._on_engine_thread(lambda: self._speak(lines))
+        missing = [line[2] for line in lines if not os.path.exists(line[2])]
+        if missing:
+            raise RuntimeError(f"Local TTS wrote no audio for {len(missing)} line(s), e.g. {missing[0]}")
+
+    def _speak(self, lines):
+        # runs on the engine thread
+        engine = self._get_engine()
+        for text, voice_id, out_path, speed, pitch, volume in lines:
+            engine.setProperty('voice', self.voice(voice_id) or LocalBackend._default_voice)
+            engine.setProperty('rate', int(LocalBackend._base_rate * max(0.5, 1.0 + float(speed))))
+            engine.setProperty('volume', min(1.0, max(0.0, float(volume))))
+            engine.save_to_file(text, out_path)
+        engine.runAndWait()
+
+
+def parse_voice_overrides(spec, voices):
+    """`role=voice,...` (TTS_LOCAL_VOICES) as {Unreal voice id: local voice}, via the processor's voices map."""
+    overrides = {}
+    for item in (spec or '').split(','):
+        role, _, local = item.partition('=')
+        if role.strip() and local.strip():
+            overrides[voices.get(role.strip(), role.strip())] = local.strip()
+    return overrides
+
+
+def make_backend(name, proc):
+    """The TTS backend called `name` ('unreal' or 'local') for proc."""
+    if name == 'unreal':
+        return UnrealSpeechBackend(proc)
+    if name == 'local':
+        return LocalBackend(parse_voice_overrides(os.getenv("TTS_LOCAL_VOICES"), proc.voices))
+    raise ValueError(f"Unknown TTS backend: {name}")
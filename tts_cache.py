@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+from effects_scheduler import try_lock_file
+
+
+class TTSCache:
+    """Persistent content-addressed store for raw TTS responses, capped by size with LRU eviction.
+
+    fetch() (and afetch() on an event loop) also coalesces misses: callers that want the same entry
+    while it is being synthesized (e.g. a job's preview and its full render) share one request.
+    Within a process they wait on the leader's Future; across processes (job workers, the ASGI
+    server) the leader holds `<key>.lock` in cache_dir and the others re-check the cache once they
+    get it.
+    """
+
+    _inflight = {}
+    _inflight_lock = threading.Lock()
+
+    def __init__(self, cache_dir="tts_cache", max_bytes=512 * 1024 * 1024, poll=0.05):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.poll = poll
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp3"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    @staticmethod
+    def key(text, voice_id, speed, pitch, volume, bitrate):
+        payload = json.dumps([text, voice_id, str(speed), str(pitch), str(volume), bitrate])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def get(self, key):
+        """Return cached bytes for key (and mark it recently used), or None."""
+        data = self._read(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def _claim(self, key):
+        """(future, leader) for an in-process miss on key; the leader must _settle() it."""
+        with TTSCache._inflight_lock:
+            future = TTSCache._inflight.get(self._path(key))
+            if future is not None:
+                return future, False
+            future = TTSCache._inflight[self._path(key)] = Future()
+            return future, True
+
+    def _settle(self, key, future, data=None, exc=None):
+        with TTSCache._inflight_lock:
+            del TTSCache._inflight[self._path(key)]
+        if isinstance(exc, asyncio.CancelledError):
+            # waiters retry rather than fail with the leader's cancellation
+            future.cancel()
+        elif exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(data)
+
+    def _try_lock(self, key):
+        return try_lock_file(os.path.join(self.cache_dir, f"{key}.lock"))
+
+    def _unlock(self, key, handle):
+        # removed while still held: processes already waiting re-check the cache, new ones hit it
+        try:
+            os.remove(os.path.join(self.cache_dir, f"{key}.lock"))
+        except OSError:
+            pass
+        os.close(handle)
+
+    def fetch(self, key, synthesize):
+        """(bytes, fetched) for key: cached bytes, or synthesize()'s, called once per concurrent miss.
+
+        `fetched` is True only for the caller that ran synthesize().
+        """
+        while True:
+            data = self.get(key)
+            if data is not None:
+                return data, False
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                return future.result(), False
+            except CancelledError:
+                continue
+        try:
+            handle = self._try_lock(key)
+            while handle is None:
+                time.sleep(self.poll)
+                handle = self._try_lock(key)
+            try:
+                data = self._read(key)
+                fetched = data is None
+                if fetched:
+                    data = synthesize()
+                    self.put(key, data)
+            finally:
+                self._unlock(key, handle)
+        except BaseException as e:
+            self._settle(key, future, exc=e)
+            raise
+        self._settle(key, future, data)
+        return data, fetched
+
+    async def afetch(self, key, synthesize):
+        """fetch() for the event loop: `synthesize` is a coroutine function, waits never block the loop."""
+        while True:
+            data = await asyncio.to_thread(self.get, key)
+            if data is not None:
+                return data, False
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                # shielded: a waiter being cancelled must not cancel the leader's Future
+                return await asyncio.shield(asyncio.wrap_future(future)), False
+            except asyncio.CancelledError:
+                # retry only if it was the leader that was cancelled, not this task
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+        try:
+            handle = self._try_lock(key)
+            while handle is None:
+                await asyncio.sleep(self.poll)
+                handle = self._try_lock(key)
+            try:
+                data = await asyncio.to_thread(self._read, key)
+                fetched = data is None
+                if fetched:
+                    data = await synthesize()
+                    await asyncio.to_thread(self.put, key, data)
+            finally:
+                self._unlock(key, handle)
+        except BaseException as e:
+            self._settle(key, future, exc=e)
+            raise
+        self._settle(key, future, data)
+        return data, fetched
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._bytes += len(data)
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self._bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}